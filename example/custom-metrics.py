@@ -23,3 +23,20 @@ def my_custom_metric_name(handle):
     rpc = flux.resource.list.resource_list(handle)
     listing = rpc.get()
     return listing.free.ncores
+
+
+def my_custom_snapshot_metric_name(handle, snapshot):
+    """
+    A custom metric with a second argument is also passed a snapshot.
+
+    The snapshot is shared with every other metric collected at the same time,
+    so reading from it does not make any extra RPCs to Flux:
+
+    - snapshot.resources: the resource listing (e.g., snapshot.resources.free)
+    - snapshot.jobs: active jobs, each a dict with an id, userid, state,
+      queue, nnodes, ntasks, ncores, and t_submit (attributes can be missing,
+      e.g., there is no queue if the instance has no queues configured)
+    - snapshot.queue: counts of jobs in each state, keyed by state name
+    """
+    jobs = [job for job in snapshot.jobs if job.get("queue") == "batch"]
+    return sum(job.get("ncores", 0) for job in jobs)
@@ -0,0 +1,137 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+import flux_metrics_api.defaults as defaults
+
+# Requests to log, from least to most (see --access-log)
+levels = ["none", "errors", "misses", "all"]
+
+# Outcomes of a request, and the level that logs them
+outcomes = {"error": 1, "miss": 2, "hit": 3}
+
+# Records waiting to be written, at most this many (the rest are dropped)
+QUEUE_SIZE = 10000
+
+# The level to log at (an index of levels), set by start
+level = 0
+
+# Records that were dropped because the queue was full
+dropped = 0
+
+access_logger = logging.getLogger("flux_metrics_api.access")
+access_logger.propagate = False
+listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format a record (with fields in its msg) as a line of JSON.
+    """
+
+    def format(self, record):
+        fields = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)),
+            "level": record.levelname.lower(),
+        }
+        fields.update(record.msg)
+        return json.dumps(fields, separators=(",", ":"))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a bounded queue, dropping them when it is full.
+
+    Records are formatted by the listener thread, not the request.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def should_log(outcome):
+    """
+    Determine if a request with an outcome (hit, miss, or error) is logged.
+
+    Errors are always logged (unless logging is off), and other requests
+    are sampled (see --access-log-sample).
+    """
+    if outcomes[outcome] > level:
+        return False
+    if outcome == "error":
+        return True
+    return (
+        defaults.ACCESS_LOG_SAMPLE >= 1 or random.random() < defaults.ACCESS_LOG_SAMPLE
+    )
+
+
+def log(request, response, outcome, start):
+    """
+    Log a request, if its outcome is logged.
+
+    This only puts the record on a queue, so it never waits on the stream.
+    """
+    if response.status_code >= 400:
+        outcome = "error"
+    if not should_log(outcome):
+        return
+    path = request.url.path
+    if request.url.query:
+        path = f"{path}?{request.url.query}"
+    fields = {
+        "outcome": outcome,
+        "status": response.status_code,
+        "method": request.method,
+        "path": path,
+        "metric": request.path_params.get("metric_name"),
+        "ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+    if "namespace" in request.path_params:
+        fields["namespace"] = request.path_params["namespace"]
+    access_logger.log(logging.ERROR if outcome == "error" else logging.INFO, fields)
+
+
+def start(stream=None):
+    """
+    Start writing logged requests (to stderr) from a background thread.
+    """
+    global level, listener
+    level = levels.index(defaults.ACCESS_LOG)
+    if not level or listener is not None:
+        return
+    records = queue.Queue(QUEUE_SIZE)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    access_logger.setLevel(logging.INFO)
+    access_logger.addHandler(DroppingQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+
+
+def stop():
+    """
+    Write any records left on the queue, and stop the background thread.
+    """
+    global listener
+    if listener is None:
+        return
+    listener.stop()
+    for handler in list(access_logger.handlers):
+        access_logger.removeHandler(handler)
+    listener = None
@@ -3,52 +3,194 @@
 #
 # SPDX-License-Identifier: (MIT)
 
+import http.client
 import json
 import os
-import subprocess
+import queue
+import ssl
+import threading
+import time
+import urllib.parse
 
 import flux_metrics_api.defaults as defaults
 import flux_metrics_api.utils as utils
+from flux_metrics_api.logger import logger
 
-# Global cache of responses
-cache = {}
 
-
-def get_kubernetes_endpoint(endpoint):
+class KubernetesClient:
     """
-    Get an endpoint from the cluster.
+    A client for the in-cluster Kubernetes API server.
+
+    Connections are kept alive and reused from a small pool, the service
+    account token is read again only when the file changes, and responses
+    are cached for a time to live.
     """
-    if defaults.USE_CACHE and endpoint in cache:
-        return cache[endpoint]
 
-    # Point to the internal API server hostname
-    api_server = "https://kubernetes.default.svc"
+    def __init__(
+        self,
+        api_server=None,
+        sa_account_dir=None,
+        timeout=None,
+        cache_ttl=None,
+        pool_size=4,
+        cache_size=64,
+    ):
+        self.api_server = api_server or defaults.KUBERNETES_API_SERVER
+        self.sa_account_dir = sa_account_dir or defaults.SERVICE_ACCOUNT_DIR
+        self.timeout = timeout or defaults.KUBERNETES_TIMEOUT
+        self.cache_ttl = (
+            cache_ttl if cache_ttl is not None else defaults.KUBERNETES_CACHE_TTL
+        )
+        self.cache_size = cache_size
+        self.cache = {}
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.lock = threading.Lock()
+        self.token = None
+        self.token_mtime = None
+        self.context = None
 
-    # Path to ServiceAccount directory
-    sa_account_dir = "/var/run/secrets/kubernetes.io/serviceaccount"
-    namespace_file = os.path.join(sa_account_dir, "namespace")
-    cert_file = os.path.join(sa_account_dir, "ca.crt")
-    token_file = os.path.join(sa_account_dir, "token")
+        url = urllib.parse.urlparse(self.api_server)
+        self.host = url.hostname
+        self.port = url.port or 443
 
-    # Cut out early if we aren't running in the pod
-    if not all(
-        map(os.path.exists, [sa_account_dir, namespace_file, token_file, cert_file])
-    ):
-        return {}
-
-    # Get the token to do the request
-    token = utils.read_file(token_file)
-
-    # Using subprocess to not add extra dependency - yes requires curl
-    # res = requests.get(f"{api_server}/apis", headers=headers, verify=cert_file)
-    # Kids don't do this at home
-    output = subprocess.check_output(
-        f'curl --cacert {cert_file} --header "Authorization: Bearer {token}" -X GET {api_server}/{endpoint}',
-        shell=True,
-    )
-    try:
-        output = json.loads(output)
-        cache[endpoint] = output
-    except Exception:
-        return {}
-    return output
+    @property
+    def namespace_file(self):
+        return os.path.join(self.sa_account_dir, "namespace")
+
+    @property
+    def cert_file(self):
+        return os.path.join(self.sa_account_dir, "ca.crt")
+
+    @property
+    def token_file(self):
+        return os.path.join(self.sa_account_dir, "token")
+
+    def in_cluster(self):
+        """
+        Determine if we are running in a pod, with a service account.
+        """
+        paths = [
+            self.sa_account_dir,
+            self.namespace_file,
+            self.token_file,
+            self.cert_file,
+        ]
+        return all(map(os.path.exists, paths))
+
+    def get_token(self):
+        """
+        Get the service account token, reading it again if the file changed.
+
+        Projected tokens are rotated by the kubelet, so we can't read it once.
+        """
+        mtime = os.stat(self.token_file).st_mtime
+        if self.token is None or mtime != self.token_mtime:
+            self.token = utils.read_file(self.token_file).strip()
+            self.token_mtime = mtime
+        return self.token
+
+    def get_idle_connection(self):
+        """
+        Get an idle (kept alive) connection from the pool, or None.
+        """
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return None
+
+    def new_connection(self):
+        """
+        Open a new connection to the API server.
+        """
+        if self.context is None:
+            self.context = ssl.create_default_context(cafile=self.cert_file)
+        return http.client.HTTPSConnection(
+            self.host, self.port, timeout=self.timeout, context=self.context
+        )
+
+    def release(self, conn):
+        """
+        Return a connection to the pool, closing it if the pool is full.
+        """
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, endpoint):
+        """
+        Issue a GET for an endpoint, returning the parsed JSON response.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.get_token()}",
+            "Accept": "application/json",
+        }
+        path = "/" + endpoint.lstrip("/")
+        conn = self.get_idle_connection()
+        if conn is not None:
+            try:
+                return self.send(conn, path, headers)
+            except (OSError, http.client.HTTPException):
+                # A kept alive connection can be closed by the server, so retry once
+                pass
+        return self.send(self.new_connection(), path, headers)
+
+    def send(self, conn, path, headers):
+        """
+        Issue a GET on a connection, keeping it for reuse if we can.
+        """
+        keep = False
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            keep = not response.will_close
+        finally:
+            if keep:
+                self.release(conn)
+            else:
+                conn.close()
+        if response.status != 200:
+            raise ValueError(f"{path} returned {response.status} {response.reason}")
+        return json.loads(body)
+
+    def get(self, endpoint):
+        """
+        Get an endpoint from the cluster, from the cache if it is fresh.
+        """
+        if defaults.USE_CACHE:
+            with self.lock:
+                cached = self.cache.get(endpoint)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+
+        # Cut out early if we aren't running in the pod
+        if not self.in_cluster():
+            return {}
+
+        try:
+            output = self.request(endpoint)
+        except Exception as e:
+            logger.warning(f"Cannot get Kubernetes endpoint {endpoint}: {e}")
+            return {}
+
+        if defaults.USE_CACHE:
+            with self.lock:
+                if endpoint not in self.cache and len(self.cache) >= self.cache_size:
+                    del self.cache[next(iter(self.cache))]
+                self.cache[endpoint] = (time.monotonic() + self.cache_ttl, output)
+        return output
+
+
+# Global client, created on first use so defaults can be customized
+client = None
+
+
+def get_kubernetes_endpoint(endpoint):
+    """
+    Get an endpoint from the cluster.
+    """
+    global client
+    if client is None:
+        client = KubernetesClient()
+    return client.get(endpoint)
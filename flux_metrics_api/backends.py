@@ -0,0 +1,127 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import threading
+
+from flux_metrics_api.logger import logger
+from flux_metrics_api.synthetic import SyntheticFlux
+
+
+class FluxBackend:
+    """
+    Get resources and jobs from a Flux instance.
+
+    The Flux Python bindings are imported when the backend is created, so
+    the rest of the server can be imported (and benchmarked) without them.
+    """
+
+    def __init__(self):
+        try:
+            import flux
+            import flux.constants
+            import flux.job
+            import flux.resource
+        except ImportError:
+            logger.exit(
+                "Cannot import flux. Please ensure that flux Python bindings are on the PYTHONPATH."
+            )
+        self.flux = flux
+
+        # Flux handles are not thread safe, so each collection thread gets its own
+        self.local = threading.local()
+
+    def reset(self):
+        """
+        Forget handles, e.g., in a forked process that must open its own.
+        """
+        self.local = threading.local()
+
+    def get_handle(self):
+        """
+        Get the flux handle for the current thread, connecting once.
+        """
+        if not hasattr(self.local, "handle"):
+            self.local.handle = self.flux.Flux()
+        return self.local.handle
+
+    def list_resources(self):
+        """
+        Issue the resource list RPC to the broker.
+        """
+        rpc = self.flux.resource.list.resource_list(self.get_handle())
+        return rpc.get()
+
+    def get_job_stats(self):
+        """
+        Get counts of jobs from the job-list stats RPC.
+        """
+        return self.get_handle().rpc("job-list.job-stats", {}).get()
+
+    def list_jobs(self, attrs, states=0):
+        """
+        List the attributes of jobs in states (a mask, 0 for all) for all users.
+        """
+        jobs = self.flux.job.job_list(
+            self.get_handle(),
+            max_entries=0,
+            attrs=attrs,
+            userid=self.flux.constants.FLUX_USERID_UNKNOWN,
+            states=states,
+        )
+        return jobs.get()["jobs"]
+
+    def event_source(self):
+        """
+        Get a source of job events from the job-manager journal.
+        """
+        import flux_metrics_api.events as events
+
+        return events.JournalEventSource()
+
+
+class SyntheticBackend(SyntheticFlux):
+    """
+    Generated resources and jobs, to run the server without a Flux instance.
+
+    Each call sleeps for latency seconds (like waiting on a broker) and custom
+    metrics are given the backend as their handle.
+    """
+
+    def reset(self):
+        pass
+
+    def get_handle(self):
+        return self
+
+
+# Backends by name (see --backend)
+backends = {"flux": FluxBackend, "synthetic": SyntheticBackend}
+
+# The backend in use, created on first use if it is not set
+backend = None
+lock = threading.Lock()
+
+
+def set_backend(name, **options):
+    """
+    Create and use a backend by name, with options for its class.
+    """
+    global backend
+    if name not in backends:
+        raise ValueError(f"{name} is not a known backend: {', '.join(backends)}")
+    backend = backends[name](**options)
+    return backend
+
+
+def get_backend():
+    """
+    Get the backend in use, connecting to Flux if none was set.
+    """
+    global backend
+    if backend is None:
+        with lock:
+            if backend is None:
+                backend = FluxBackend()
+    return backend
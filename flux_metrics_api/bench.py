@@ -0,0 +1,242 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+import json
+import multiprocessing
+import resource
+import socket
+import sys
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+
+import flux_metrics_api.backends as backends
+import flux_metrics_api.collector as collector
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.metrics as metrics
+import flux_metrics_api.responses as responses
+from flux_metrics_api.routes import prepare_documents, routes
+from flux_metrics_api.server import get_synthetic_options, lifespan
+
+
+def get_routes(namespace, queue):
+    """
+    Get the paths to benchmark, keyed by a short name for each route.
+    """
+    metrics = f"{defaults.API_ROOT}/namespaces/{namespace}/metrics"
+    objects = f"{defaults.API_ROOT}/namespaces/{namespace}"
+    return {
+        "root": defaults.API_ROOT,
+        "groups": "/apis",
+        "openapi": "/openapi/v2",
+        "node": f"{metrics}/node_cores_free_count",
+        "queue": f"{metrics}/job_queue_state_run_count",
+        "rate": f"{metrics}/job_start_rate",
+        "batch": f"{metrics}/*",
+        "selector": f"{metrics}/job_queue_state_run_count?labelSelector=queue={queue}",
+        "window": f"{metrics}/job_queue_state_run_count?window=1h",
+        "object": f"{objects}/nodes/node0/node_cores_free_count",
+        "property": f"{objects}/properties/{queue}/node_free_count",
+        "prometheus": "/metrics",
+    }
+
+
+# Routes that forward to the Kubernetes API, only benchmarked when asked for
+forwarded = ["groups", "openapi"]
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile (fraction of 1) of sorted values, or 0 if there are none.
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def serve(args, sock, conn):
+    """
+    Serve the app against synthetic Flux data (in a forked process).
+
+    The parent asks for counts of calls to Flux ("rpcs") over the pipe, and
+    we send our peak RSS when asked to "stop".
+    """
+    synthetic = backends.set_backend("synthetic", **get_synthetic_options(args))
+
+    defaults.COLLECT_INTERVAL = args.collect_interval
+    defaults.ACCESS_LOG = "errors"
+    metrics.resource_listing.ttl = args.resource_ttl
+    metrics.queue_counts.ttl = args.queue_ttl
+    metrics.queue_labels.ttl = args.queue_ttl
+    metrics.job_listing.ttl = args.queue_ttl
+
+    # Windowed metrics need history, so collect once if the collector is off
+    # (the window route asks for the last hour, to cover the benchmark)
+    if not args.collect_interval:
+        collector.collect_all()
+        collector.rendered.clear()
+        collector.values = {}
+
+    responses.prepare()
+    prepare_documents()
+    app = Starlette(routes=routes, lifespan=lifespan)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+
+    def listen():
+        while True:
+            command = conn.recv()
+            if command == "rpcs":
+                with synthetic.lock:
+                    conn.send(dict(synthetic.rpcs))
+            elif command == "stop":
+                server.should_exit = True
+                return
+
+    threading.Thread(target=listen, daemon=True).start()
+    conn.send("ready")
+    server.run(sockets=[sock])
+    conn.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+async def get(reader, writer, path):
+    """
+    Make one GET request on a kept alive connection, and return the status.
+    """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status.split()[1])
+
+
+async def drive(port, path, requests, concurrency):
+    """
+    Make requests to a path over concurrent connections.
+
+    Returns the latency (seconds) of each request, errors, and elapsed seconds.
+    """
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def client():
+        nonlocal errors, remaining
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    status = await get(reader, writer, path)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    errors += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return sorted(latencies), errors, time.perf_counter() - start
+
+
+def run_route(port, conn, path, args):
+    """
+    Benchmark one route, after a warmup, and summarize the results.
+    """
+    asyncio.run(drive(port, path, args.warmup, args.concurrency))
+    conn.send("rpcs")
+    before = conn.recv()
+    latencies, errors, elapsed = asyncio.run(
+        drive(port, path, args.requests, args.concurrency)
+    )
+    conn.send("rpcs")
+    after = conn.recv()
+    rpcs = sum(after.values()) - sum(before.values())
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "rpcs_per_request": round(rpcs / args.requests, 3),
+    }
+
+
+def show(results, rss):
+    """
+    Print results as a table.
+    """
+    columns = ["rps", "p50_ms", "p99_ms", "errors", "rpcs_per_request"]
+    print(f"{'route':12}" + "".join(f"{x:>18}" for x in columns))
+    for name, result in results.items():
+        print(f"{name:12}" + "".join(f"{result[x]:>18}" for x in columns))
+    print(f"\nPeak RSS of the server: {rss / 1024:.1f} MiB")
+
+
+def run(args):
+    """
+    Benchmark each route of the server against synthetic Flux data.
+    """
+    routes = get_routes(defaults.NAMESPACE, args.queues.split(",")[0])
+    names = args.route or [x for x in routes if x not in forwarded]
+    for name in names:
+        if name not in routes:
+            sys.exit(f"{name} is not a known route: {', '.join(routes)}")
+
+    # asyncio only disables Nagle's algorithm for sockets of the TCP protocol
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+
+    if not args.json:
+        print(f"Generating {args.jobs} jobs on {args.nodes} nodes...")
+    context = multiprocessing.get_context("fork")
+    conn, child = context.Pipe()
+    process = context.Process(target=serve, args=(args, sock, child))
+    process.start()
+    conn.recv()
+
+    # The server listens when it starts, so wait until it accepts connections
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_route(port, conn, routes[name], args)
+            if not args.json:
+                print(f"Finished {name} ({routes[name]})")
+    finally:
+        conn.send("stop")
+        rss = conn.recv() if conn.poll(10) else 0
+        process.join(10)
+        sock.close()
+
+    if args.json:
+        print(json.dumps({"routes": results, "peak_rss_kb": rss}, indent=4))
+    else:
+        print()
+        show(results, rss)
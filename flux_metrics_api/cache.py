@@ -0,0 +1,66 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import threading
+import time
+
+
+class CachedCall:
+    """
+    Cache the result of a (typically Flux RPC) call for a time to live (ttl).
+
+    Concurrent callers are coalesced: if a refresh is already in flight,
+    callers wait for it and share the result instead of issuing their own
+    call. A ttl of 0 means we never serve a result older than the call
+    that was running when we arrived.
+    """
+
+    def __init__(self, func, ttl=0):
+        self.func = func
+        self.ttl = ttl
+        self.value = None
+        self.updated = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+        # Calls served without (hits) and with (misses) calling func
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self):
+        """
+        Determine if the cached value can be served without a refresh.
+        """
+        if self.updated is None or not self.ttl:
+            return False
+        return (time.monotonic() - self.updated) < self.ttl
+
+    def clear(self):
+        """
+        Drop the cached value so the next get will refresh.
+        """
+        with self.lock:
+            self.updated = None
+            self.value = None
+
+    def get(self):
+        """
+        Get the cached value, refreshing if it has expired.
+        """
+        if self.is_fresh():
+            self.hits += 1
+            return self.value
+
+        # Take note of the generation so we know if someone refreshed for us
+        generation = self.generation
+        with self.lock:
+            if self.generation != generation or self.is_fresh():
+                self.hits += 1
+                return self.value
+            self.misses += 1
+            self.value = self.func()
+            self.updated = time.monotonic()
+            self.generation += 1
+            return self.value
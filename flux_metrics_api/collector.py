@@ -0,0 +1,135 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+import time
+
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.executor as executor
+import flux_metrics_api.history as history
+import flux_metrics_api.metrics as metrics
+import flux_metrics_api.responses as responses
+import flux_metrics_api.store as store
+import flux_metrics_api.types as types
+from flux_metrics_api.logger import logger
+
+# Pre-rendered MetricValueList responses from the last cycle, keyed by metric name
+rendered = {}
+
+# Metric values from the last cycle, keyed by metric name
+values = {}
+
+# When (monotonic) each metric was last collected
+collected_at = {}
+
+
+def render(
+    values, windowSeconds=0, selector=None, describedObject=None, timestamp=None
+):
+    """
+    Render the MetricValueList response for metric values, keyed by name.
+
+    A selector (dict of labels) the values were selected by is included in
+    the metric identifiers, and describedObject defaults to our service.
+    The timestamp (when the values were collected) defaults to now.
+    """
+    if selector:
+        selector = {"matchLabels": selector}
+    items = []
+    for metric_name, value in values.items():
+        metric = types.new_identifier(metric_name, selector=selector)
+        items.append(
+            responses.render_metric(
+                metric,
+                value,
+                timestamp=timestamp,
+                windowSeconds=windowSeconds,
+                describedObject=describedObject,
+            )
+        )
+    return responses.render_metric_list(items)
+
+
+def get_metric_names():
+    """
+    Get the names of all built-in and custom metrics.
+    """
+    return list(metrics.metrics) + list(metrics.custom_metrics)
+
+
+def collect_values(metric_names=None):
+    """
+    Collect built-in and custom metrics (defaults to all) from one snapshot.
+
+    Metrics that fail are logged and left out.
+    """
+    snapshot = metrics.Snapshot()
+    collected = {}
+    for metric_name in metric_names or get_metric_names():
+        try:
+            collected[metric_name] = metrics.collect(metric_name, snapshot)
+        except Exception as e:
+            logger.warning(f"Cannot collect metric {metric_name}: {e}")
+    return collected
+
+
+def collect_all():
+    """
+    Collect and render every built-in and custom metric from one snapshot.
+    """
+    collected = collect_values()
+    publish(collected)
+    store.record(collected)
+
+
+def is_fresh(metric_name):
+    """
+    Determine if a metric from the collector is within --max-staleness.
+    """
+    if not defaults.MAX_STALENESS:
+        return True
+    collected = collected_at.get(metric_name)
+    return collected is not None and (
+        time.monotonic() - collected <= defaults.MAX_STALENESS
+    )
+
+
+def publish(collected):
+    """
+    Render and serve the values (keyed by name) from one collection cycle.
+
+    A metric that failed is dropped, so requests for it fall back to
+    collecting on demand (and report the error). With --max-staleness, we
+    keep serving its last good value (and timestamp) until it is too old.
+    """
+    global values
+    now = time.monotonic()
+    for metric_name in collected:
+        collected_at[metric_name] = now
+    kept = {}
+    if defaults.MAX_STALENESS:
+        kept = {x: v for x, v in values.items() if x not in collected and is_fresh(x)}
+
+    for metric_name in list(rendered):
+        if metric_name not in collected and metric_name not in kept:
+            del rendered[metric_name]
+    for metric_name, value in collected.items():
+        rendered[metric_name] = render({metric_name: value})
+
+    # Replace (and not update) so readers always see one whole cycle
+    values = {**kept, **collected}
+    history.record(collected)
+
+
+async def run(interval):
+    """
+    Refresh all metrics every interval seconds, until cancelled.
+    """
+    while True:
+        try:
+            await executor.run(collect_all)
+        except Exception as e:
+            logger.error(f"Metric collection cycle failed: {e}")
+        await asyncio.sleep(interval)
@@ -9,6 +9,50 @@ NAMESPACE = "flux-operator"
 SERVICE_NAME = "custom-metrics-apiserver"
 USE_CACHE = True
 
+# The in-cluster Kubernetes API server, and seconds to cache and wait for responses
+KUBERNETES_API_SERVER = "https://kubernetes.default.svc"
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+KUBERNETES_CACHE_TTL = 300
+KUBERNETES_TIMEOUT = 10
+
+# Seconds to cache Flux RPC results for (0 to only coalesce concurrent calls)
+RESOURCE_TTL = 0
+QUEUE_TTL = 0
+
+# Threads to collect metrics with, and seconds to wait for a metric
+THREADS = 8
+METRIC_TIMEOUT = 10
+
+# Seconds that last good values can be served for when collecting fails or
+# is slow (0 to never serve them), and seconds to wait before serving them
+MAX_STALENESS = 0
+STALE_AFTER = 0.1
+
+# Seconds between background collection of all metrics (0 to collect on request)
+COLLECT_INTERVAL = 0
+
+# Samples of each metric kept by the collector, for windowed metrics
+HISTORY_SIZE = 720
+
+# Directory to keep the history of every metric in across restarts (None to
+# not keep it), and the most records returned by one history request
+HISTORY_DIR = None
+HISTORY_LIMIT = 10000
+
+# Minimum seconds between updates of rate (throughput) metrics
+RATE_INTERVAL = 10
+
+# Requests to log (none, errors, misses, or all), and the fraction of
+# requests that are not errors to log
+ACCESS_LOG = "misses"
+ACCESS_LOG_SAMPLE = 1.0
+
+# Server processes, the collect interval to use with more than one, and bytes
+# of shared memory for the values they share
+WORKERS = 1
+WORKERS_COLLECT_INTERVAL = 5
+SHARED_VALUES_SIZE = 1 << 20
+
 
 def API_VERSION():
     """
@@ -0,0 +1,205 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import queue
+import threading
+
+from flux_metrics_api.logger import logger
+from flux_metrics_api.metrics import job_states
+
+# Events that move a job to a new state, and the states they can move it from.
+# See https://github.com/flux-framework/flux-core/blob/master/src/modules/job-manager/event.c
+transitions = {
+    "submit": ("new", None),
+    "validate": ("depend", {"new"}),
+    "invalidate": ("inactive", {"new"}),
+    "depend": ("priority", {"depend"}),
+    "priority": ("sched", {"priority"}),
+    "alloc": ("run", {"sched"}),
+    "finish": ("cleanup", {"run"}),
+    "clean": ("inactive", {"cleanup"}),
+}
+
+# A fatal exception sends a job to cleanup from any of these states
+exception_states = {"depend", "priority", "sched", "run"}
+
+
+def next_state(state, name, context=None):
+    """
+    Given a job's current state and an event, return the new state (or None).
+    """
+    if name == "exception":
+        context = context or {}
+        if context.get("severity") == 0 and state in exception_states:
+            return "cleanup"
+        return None
+    if name not in transitions:
+        return None
+    new_state, from_states = transitions[name]
+    if from_states is not None and state not in from_states:
+        return None
+    return new_state
+
+
+class QueueCounters:
+    """
+    Per state job counts, updated incrementally from job events.
+
+    We only remember the state of jobs that are not yet inactive, so memory
+    scales with active jobs and reads are O(1) regardless of job history.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.counts = {name: 0 for name in job_states.values()}
+
+        # Cumulative count of jobs that have entered each state
+        self.entered = {name: 0 for name in job_states.values()}
+
+        # Set when the history of the event source has been replayed
+        self.ready = threading.Event()
+
+    def update(self, jobid, name, context=None):
+        """
+        Update counts for one job event.
+        """
+        with self.lock:
+            state = self.states.get(jobid)
+            new_state = next_state(state, name, context)
+            if new_state is None or new_state == state:
+                return
+            if state is not None:
+                self.counts[state] -= 1
+            self.counts[new_state] += 1
+            self.entered[new_state] += 1
+            if new_state == "inactive":
+                self.states.pop(jobid, None)
+            else:
+                self.states[jobid] = new_state
+
+    def get(self):
+        """
+        Get a copy of the current counts, keyed by state name.
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def get_totals(self):
+        """
+        Get a copy of the number of jobs that have entered each state.
+        """
+        with self.lock:
+            return dict(self.entered)
+
+    def watch(self, source):
+        """
+        Consume events from a source until it is exhausted.
+
+        A source yields (jobid, name, context) tuples, where a jobid of None
+        indicates that historical events have all been replayed.
+        """
+        for jobid, name, context in source.events():
+            if jobid is None:
+                self.ready.set()
+                continue
+            self.update(jobid, name, context)
+
+
+class JournalEventSource:
+    """
+    Stream job events from the Flux job-manager journal.
+
+    The journal is replayed from the beginning, so the counters start out
+    matching the job listing. We open our own handle since this runs in a thread.
+    """
+
+    def events(self):
+        import flux
+        import flux.constants
+        import flux.job
+
+        handle = flux.Flux()
+        if hasattr(flux.job, "JournalConsumer"):
+            yield from self.consume(flux.job.JournalConsumer(handle, full=True))
+            return
+
+        # Older Flux without the consumer class, use the streaming RPC directly
+        rpc = handle.rpc(
+            "job-manager.events-journal",
+            {"full": True},
+            flags=flux.constants.FLUX_RPC_STREAMING,
+        )
+        while True:
+            response = rpc.get()
+            rpc.reset()
+
+            # A negative id is a sentinel for the end of the history
+            if response["id"] < 0:
+                yield None, None, None
+                continue
+            for event in response["events"]:
+                yield response["id"], event["name"], event.get("context")
+
+    def consume(self, consumer):
+        """
+        Yield events from a flux.job.JournalConsumer.
+        """
+        consumer.start()
+        while True:
+            event = consumer.poll()
+            if event is None:
+                return
+            if event.is_empty():
+                yield None, None, None
+                continue
+            yield event.jobid, event.name, event.context
+
+
+class FakeEventSource:
+    """
+    A local event source, e.g., to test counters without a Flux instance.
+    """
+
+    def __init__(self, events=None):
+        self.queue = queue.Queue()
+        for event in events or []:
+            self.emit(*event)
+
+    def emit(self, jobid, name, context=None):
+        self.queue.put((jobid, name, context))
+
+    def close(self):
+        """
+        Stop the stream of events.
+        """
+        self.queue.put(None)
+
+    def events(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            yield event
+
+
+def watch_queue(source):
+    """
+    Start a thread that keeps queue counters updated from an event source.
+    """
+    counters = QueueCounters()
+
+    def run():
+        try:
+            counters.watch(source)
+        except Exception as e:
+            logger.error(f"Stopped watching job events: {e}")
+
+        # Readers go back to listing jobs
+        counters.ready.clear()
+
+    thread = threading.Thread(target=run, name="flux-metrics-events", daemon=True)
+    thread.start()
+    return counters
@@ -0,0 +1,67 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import flux_metrics_api.defaults as defaults
+
+# Bounded pool of threads for blocking (Flux) calls, created on first use
+executor = None
+
+# Calls in flight, keyed by what they collect (see run_shared)
+inflight = {}
+
+
+def get_executor():
+    """
+    Get the shared thread pool, creating it with defaults.THREADS workers.
+    """
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=defaults.THREADS, thread_name_prefix="flux-metrics"
+        )
+    return executor
+
+
+async def run(func, *args, timeout=None):
+    """
+    Run a blocking function in the pool without blocking the event loop.
+
+    Raises asyncio.TimeoutError if the result is not ready after timeout
+    seconds. The call itself cannot be interrupted, so it continues to hold
+    its thread until the broker responds.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_executor(), func, *args)
+    return await asyncio.wait_for(future, timeout or None)
+
+
+async def run_shared(key, func, *args, timeout=None):
+    """
+    Run a blocking function in the pool, sharing one call per key.
+
+    Concurrent requests for the same key (e.g., a metric name and selector)
+    wait on the call already in flight and share its result (or error), so
+    calls to Flux are bounded by distinct keys and not by requests. A
+    request that times out stops waiting without cancelling the call.
+    """
+    future = inflight.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(get_executor(), func, *args)
+        inflight[key] = future
+
+        def done(future):
+            if inflight.get(key) is future:
+                del inflight[key]
+
+            # Retrieve the error, in case every waiter timed out
+            if not future.cancelled():
+                future.exception()
+
+        future.add_done_callback(done)
+    return await asyncio.wait_for(asyncio.shield(future), timeout or None)
@@ -0,0 +1,108 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import numbers
+import threading
+import time
+from array import array
+
+import flux_metrics_api.defaults as defaults
+
+# Ways to summarize samples over a window
+aggregates = ["avg", "max", "min", "rate"]
+
+
+class RingBuffer:
+    """
+    A fixed size buffer of (timestamp, value) samples for one metric.
+
+    Samples are kept in two preallocated arrays of doubles and the oldest is
+    overwritten when full, so memory does not grow with server uptime.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array("d", [0.0]) * size
+        self.values = array("d", [0.0]) * size
+
+        # Index of the next sample to write, and number of samples written
+        self.index = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self.lock:
+            self.times[self.index] = timestamp
+            self.values[self.index] = value
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def window(self, seconds, now=None):
+        """
+        Get samples from the last seconds, oldest first.
+        """
+        cutoff = (now or time.time()) - seconds
+        samples = []
+        with self.lock:
+            for i in range(1, self.count + 1):
+                index = (self.index - i) % self.size
+                if self.times[index] < cutoff:
+                    break
+                samples.append((self.times[index], self.values[index]))
+        samples.reverse()
+        return samples
+
+    def summarize(self, seconds, aggregate="avg", now=None):
+        """
+        Summarize the samples from the last seconds, or None if there are none.
+
+        Returns the value with the seconds the samples actually cover (from
+        the oldest sample to now), which can be less than asked for.
+        """
+        now = now or time.time()
+        samples = self.window(seconds, now=now)
+        if not samples:
+            return None
+        span = now - samples[0][0]
+        values = [x[1] for x in samples]
+        if aggregate == "max":
+            return max(values), span
+        if aggregate == "min":
+            return min(values), span
+        if aggregate == "rate":
+            elapsed = samples[-1][0] - samples[0][0]
+            if not elapsed:
+                return 0.0, span
+            return (samples[-1][1] - samples[0][1]) / elapsed, span
+        return sum(values) / len(values), span
+
+
+# One buffer per metric, keyed by name
+buffers = {}
+
+
+def record(values, timestamp=None):
+    """
+    Record a sample for each metric value (keyed by name) that is a number.
+    """
+    timestamp = timestamp or time.time()
+    for metric_name, value in values.items():
+        if not isinstance(value, numbers.Real):
+            continue
+        buffer = buffers.get(metric_name)
+        if buffer is None:
+            buffer = buffers[metric_name] = RingBuffer(defaults.HISTORY_SIZE)
+        buffer.append(timestamp, value)
+
+
+def summarize(metric_name, seconds, aggregate="avg"):
+    """
+    Summarize a metric over a window, as (value, seconds covered), or None
+    if we have no samples.
+    """
+    buffer = buffers.get(metric_name)
+    if buffer is None:
+        return None
+    return buffer.summarize(seconds, aggregate)
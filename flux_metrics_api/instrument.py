@@ -0,0 +1,236 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+import bisect
+import collections
+import contextlib
+import gc
+import threading
+import time
+
+# Measure the server only when asked (see --verbose)
+enabled = False
+
+# Upper bounds (seconds) of histogram buckets
+buckets = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+]
+
+# Seconds between checks of how late the event loop wakes up
+LOOP_INTERVAL = 0.5
+
+
+class Histogram:
+    """
+    Counts of observations (e.g., seconds) in buckets, with their sum.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def get_state(self):
+        """
+        Get the counts, count, and sum, e.g., to share with another process.
+        """
+        with self.lock:
+            return [list(self.counts), self.count, self.sum]
+
+    def render(self, name, labels=""):
+        """
+        Render the histogram as Prometheus samples (without HELP or TYPE).
+        """
+        prefix = labels + "," if labels else ""
+        with self.lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ["+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {float(total)!r}")
+        lines.append(f"{name}_count{labels} {count}")
+        return lines
+
+
+# Seconds to collect each metric, and for each call to Flux (by call site)
+collect_seconds = collections.defaultdict(Histogram)
+call_seconds = collections.defaultdict(Histogram)
+
+# Seconds the event loop woke up late, and garbage collection pauses by generation
+loop_lag_seconds = Histogram()
+gc_pause_seconds = collections.defaultdict(Histogram)
+gc_started = {}
+
+# Measurements shared by the process that collects metrics (the parent of
+# workers), merged with ours when we render them
+shared = {}
+
+
+@contextlib.contextmanager
+def timed(histograms, name):
+    """
+    Time a block into a histogram (of a dict) by name, if we are enabled.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograms[name].observe(time.perf_counter() - start)
+
+
+def on_gc(phase, info):
+    """
+    Time garbage collection pauses (a gc.callbacks callback).
+    """
+    if phase == "start":
+        gc_started[threading.get_ident()] = time.perf_counter()
+        return
+    start = gc_started.pop(threading.get_ident(), None)
+    if start is not None:
+        gc_pause_seconds[info["generation"]].observe(time.perf_counter() - start)
+
+
+async def watch_loop(interval=LOOP_INTERVAL):
+    """
+    Measure how late the event loop wakes up from a sleep, until cancelled.
+
+    Lag means something (e.g., serialization) blocked the loop, delaying
+    every request waiting on it.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0, time.perf_counter() - start - interval))
+
+
+def enable():
+    """
+    Start measuring the server, including garbage collection.
+    """
+    global enabled
+    enabled = True
+    if on_gc not in gc.callbacks:
+        gc.callbacks.append(on_gc)
+
+
+def get_measurements(caches):
+    """
+    Get measurements of collecting metrics in this process, to share.
+
+    caches are CachedCall instances keyed by name, to share hits for.
+    """
+    return {
+        "collect_seconds": {k: v.get_state() for k, v in dict(collect_seconds).items()},
+        "call_seconds": {k: v.get_state() for k, v in dict(call_seconds).items()},
+        "caches": {name: [cache.hits, cache.misses] for name, cache in caches.items()},
+    }
+
+
+def combine(histograms, states):
+    """
+    Combine histograms (keyed by name) with shared states of histograms.
+    """
+    combined = dict(histograms)
+    for name, (counts, count, total) in states.items():
+        histogram = Histogram()
+        histogram.counts, histogram.count, histogram.sum = list(counts), count, total
+        if name in combined:
+            counts, count, total = combined[name].get_state()
+            histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+            histogram.count += count
+            histogram.sum += total
+        combined[name] = histogram
+    return combined
+
+
+def render_histograms(name, helptext, histograms, label):
+    lines = [f"# HELP {name} {helptext}", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        lines += histogram.render(name, f'{label}="{key}"')
+    return lines
+
+
+def render(caches):
+    """
+    Render measurements of the server in the Prometheus text format.
+
+    caches are CachedCall instances keyed by name, to report hits for.
+    Measurements shared by another process are added to ours.
+    """
+    lines = render_histograms(
+        "flux_metrics_api_collect_seconds",
+        "Seconds to collect a metric",
+        combine(collect_seconds, shared.get("collect_seconds", {})),
+        "metric",
+    )
+    lines += render_histograms(
+        "flux_metrics_api_flux_call_seconds",
+        "Seconds for a call to Flux (e.g., an RPC), by call site",
+        combine(call_seconds, shared.get("call_seconds", {})),
+        "call",
+    )
+
+    lines.append(
+        "# HELP flux_metrics_api_cache_requests_total Requests for cached Flux data"
+    )
+    lines.append("# TYPE flux_metrics_api_cache_requests_total counter")
+    ratios = []
+    for name, cache in caches.items():
+        shared_hits, shared_misses = shared.get("caches", {}).get(name, [0, 0])
+        hits, misses = cache.hits + shared_hits, cache.misses + shared_misses
+        for result, count in [("hit", hits), ("miss", misses)]:
+            lines.append(
+                f'flux_metrics_api_cache_requests_total{{cache="{name}",result="{result}"}} {count}'
+            )
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        ratios.append(f'flux_metrics_api_cache_hit_ratio{{cache="{name}"}} {ratio!r}')
+    lines.append(
+        "# HELP flux_metrics_api_cache_hit_ratio Fraction of requests for cached Flux data that did not call Flux"
+    )
+    lines.append("# TYPE flux_metrics_api_cache_hit_ratio gauge")
+    lines += ratios
+
+    lines.append(
+        "# HELP flux_metrics_api_event_loop_lag_seconds Seconds the event loop woke up late"
+    )
+    lines.append("# TYPE flux_metrics_api_event_loop_lag_seconds histogram")
+    lines += loop_lag_seconds.render("flux_metrics_api_event_loop_lag_seconds")
+    lines += render_histograms(
+        "flux_metrics_api_gc_pause_seconds",
+        "Seconds garbage collection paused the server, by generation",
+        dict(gc_pause_seconds),
+        "generation",
+    )
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
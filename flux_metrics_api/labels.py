@@ -0,0 +1,90 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import collections
+import functools
+import itertools
+import pwd
+
+# Labels that queue metrics can be selected by
+supported = ["queue", "user"]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_username(userid):
+    """
+    Get the name of a user, or the userid (as a string) if it is unknown.
+    """
+    try:
+        return pwd.getpwuid(int(userid)).pw_name
+    except (KeyError, ValueError):
+        return str(userid)
+
+
+def parse_selector(selector):
+    """
+    Parse a label selector (e.g., queue=batch,user=alice) into a dict.
+
+    We only support equality, and a user can be given by name or userid.
+    """
+    labels = {}
+    for requirement in selector.split(","):
+        requirement = requirement.strip()
+        if not requirement:
+            continue
+        if "!=" in requirement or "=" not in requirement:
+            raise ValueError(f"{requirement} is not supported, use label=value")
+        label, value = requirement.replace("==", "=").split("=", 1)
+        label = label.strip()
+        value = value.strip()
+        if label not in supported:
+            raise ValueError(
+                f"{label} is not a supported label, choices are {', '.join(supported)}"
+            )
+        if label == "user" and value.isdigit():
+            value = get_username(value)
+        labels[label] = value
+    if not labels:
+        raise ValueError("The label selector is empty.")
+    return labels
+
+
+class LabelIndex:
+    """
+    Counts of jobs in each state, indexed by every combination of labels.
+
+    Each job is added under each combination of its labels (e.g., its queue,
+    its user, and both) so any selector is a single lookup.
+    """
+
+    def __init__(self):
+        self.counts = collections.defaultdict(collections.Counter)
+
+        # Set when inactive jobs have been counted (by queue)
+        self.has_inactive = False
+
+    def key(self, labels):
+        return frozenset(labels.items())
+
+    def add_job(self, state, labels):
+        """
+        Count a job in a state, with labels (a dict of label to value).
+        """
+        labels = [x for x in labels.items() if x[1] is not None]
+        for size in range(1, len(labels) + 1):
+            for combination in itertools.combinations(labels, size):
+                self.counts[frozenset(combination)][state] += 1
+
+    def add_counts(self, labels, counts):
+        """
+        Add counts (keyed by state) for a selector.
+        """
+        self.counts[self.key(labels)].update(counts)
+
+    def get(self, labels):
+        """
+        Get counts for a selector, keyed by state.
+        """
+        return self.counts.get(self.key(labels), collections.Counter())
@@ -4,166 +4,444 @@
 # SPDX-License-Identifier: (MIT)
 
 import collections
-import importlib.util
-import inspect
-import os
-import shutil
-import sys
-
-import flux_metrics_api.utils as utils
+import errno
+
+import flux_metrics_api.backends as backends
+import flux_metrics_api.cache as cache
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.instrument as instrument
+import flux_metrics_api.labels as labels
+import flux_metrics_api.resources as resources
 from flux_metrics_api.logger import logger
+from flux_metrics_api.rates import Rate
+
 
-try:
-    import flux
-    import flux.job
-    import flux.resource
-except ImportError:
-    logger.exit(
-        "Cannot import flux. Please ensure that flux Python bindings are on the PYTHONPATH."
-    )
+def get_handle():
+    """
+    Get the flux handle for the current thread, connecting once.
+    """
+    return backends.get_backend().get_handle()
 
 
-# Keep a global handle so we make it just once
-handle = flux.Flux()
+def list_resources():
+    """
+    Issue the resource list RPC to the broker.
+    """
+    with instrument.timed(instrument.call_seconds, "resource_list"):
+        return backends.get_backend().list_resources()
+
 
+# All node metrics share one cached listing (see --resource-ttl)
+resource_listing = cache.CachedCall(list_resources, ttl=defaults.RESOURCE_TTL)
 
-def node_core_free_count():
+
+def node_core_free_count(snapshot):
     """
-    Function to use the flux handle to get node cores free
+    Number of node cores free in the instance
     """
-    rpc = flux.resource.list.resource_list(handle)
-    listing = rpc.get()
+    listing = snapshot.resources
     return listing.free.ncores
 
 
-def node_core_up_count():
+def node_core_up_count(snapshot):
     """
-    Function to use the flux handle to get node cores up
+    Number of node cores up in the instance
     """
-    rpc = flux.resource.list.resource_list(handle)
-    listing = rpc.get()
+    listing = snapshot.resources
     return listing.up.ncores
 
 
-def node_up_count():
+def node_up_count(snapshot):
     """
-    Function to use the flux handle to get nodes up
+    Number of nodes up in the instance
     """
-    rpc = flux.resource.list.resource_list(handle)
-    listing = rpc.get()
+    listing = snapshot.resources
     return len(listing.up.nodelist)
 
 
-def node_free_count():
+def node_free_count(snapshot):
     """
-    Function to use the flux handle to get nodes free
+    Number of nodes free in the instance
     """
-    rpc = flux.resource.list.resource_list(handle)
-    listing = rpc.get()
+    listing = snapshot.resources
     return len(listing.free.nodelist)
 
 
+def node_gpus_free_count(snapshot):
+    """
+    Number of node gpus free in the instance
+    """
+    listing = snapshot.resources
+    return listing.free.ngpus
+
+
+def node_gpus_up_count(snapshot):
+    """
+    Number of node gpus up in the instance
+    """
+    listing = snapshot.resources
+    return listing.up.ngpus
+
+
+# Metrics for one node (or nodes with a property), and the count they come from
+object_metrics = {
+    "node_cores_free_count": "free_cores",
+    "node_cores_up_count": "up_cores",
+    "node_gpus_free_count": "free_gpus",
+    "node_gpus_up_count": "up_gpus",
+    "node_free_count": "free_nodes",
+    "node_up_count": "up_nodes",
+}
+
+
+# Lookup of state integer to name
+# See https://github.com/flux-framework/flux-core/blob/master/src/common/libjob/job.h#L45-L53
+job_states = {
+    1: "new",
+    2: "depend",
+    4: "priority",
+    8: "sched",
+    16: "run",
+    32: "cleanup",
+    64: "inactive",
+}
+
+
+# Set to False if the job-list module does not support the stats RPC
+use_job_stats = True
+
+
+def get_job_stats():
+    """
+    Get counts of jobs from the job-list stats RPC.
+
+    This returns counts for all users, and the payload does not grow with
+    the number of jobs.
+    """
+    with instrument.timed(instrument.call_seconds, "job_stats"):
+        return backends.get_backend().get_job_stats()
+
+
+def list_jobs(attrs, states=0):
+    """
+    List only the attributes we need of jobs for all users.
+
+    states is a mask of states to list, where 0 lists all jobs.
+    """
+    with instrument.timed(instrument.call_seconds, "job_list"):
+        return backends.get_backend().list_jobs(attrs, states=states)
+
+
+def count_queue_states():
+    """
+    Count jobs in each queue state.
+
+    We ask the job-list module for stats when it supports it, and otherwise
+    count a listing of only job states in a single pass.
+    """
+    global use_job_stats
+    if use_job_stats:
+        try:
+            stats = get_job_stats()["job_states"]
+            return {name: stats.get(name, 0) for name in job_states.values()}
+        except OSError as e:
+            if e.errno != errno.ENOSYS:
+                raise
+            logger.warning("Job stats are not supported, will list jobs instead.")
+            use_job_stats = False
+
+    counter = collections.Counter(job["state"] for job in list_jobs(["state"]))
+    return {name: counter.get(stateint, 0) for stateint, name in job_states.items()}
+
+
+# All queue state metrics share one cached count (see --queue-ttl)
+queue_counts = cache.CachedCall(count_queue_states, ttl=defaults.QUEUE_TTL)
+
+# Mask to list active (not inactive) jobs
+active_states = sum(x for x, name in job_states.items() if name != "inactive")
+
+
+def count_labelled_states():
+    """
+    Count jobs in each state by queue and user, in one pass over active jobs.
+
+    Listing inactive jobs would grow with job history, so inactive jobs are
+    only counted by queue, and only when job stats are supported.
+    """
+    global use_job_stats
+    index = labels.LabelIndex()
+    for job in list_jobs(["state", "queue", "userid"], states=active_states):
+        user = labels.get_username(job["userid"]) if "userid" in job else None
+        index.add_job(
+            job_states.get(job["state"]), {"queue": job.get("queue"), "user": user}
+        )
+
+    if use_job_stats:
+        try:
+            stats = get_job_stats()
+        except OSError as e:
+            if e.errno != errno.ENOSYS:
+                raise
+            logger.warning("Job stats are not supported, will list jobs instead.")
+            use_job_stats = False
+            return index
+
+        # Older job-list modules do not count jobs by queue
+        if "queues" in stats:
+            index.has_inactive = True
+        for queue in stats.get("queues", []):
+            inactive = queue.get("job_states", {}).get("inactive", 0)
+            index.add_counts({"queue": queue["name"]}, {"inactive": inactive})
+    return index
+
+
+# Queue metrics selected by label share one cached index (see --queue-ttl)
+queue_labels = cache.CachedCall(count_labelled_states, ttl=defaults.QUEUE_TTL)
+
+# Attributes of active jobs that custom metrics can use from a snapshot
+job_attrs = ["id", "userid", "state", "queue", "nnodes", "ntasks", "ncores", "t_submit"]
+
+
+def list_active_jobs():
+    """
+    List active jobs for all users, with the attributes in job_attrs.
+    """
+    return list_jobs(job_attrs, states=active_states)
+
+
+# Custom metrics share one cached listing of active jobs (see --queue-ttl)
+job_listing = cache.CachedCall(list_active_jobs, ttl=defaults.QUEUE_TTL)
+
+# Cached Flux data by name, to report hits for (see /metrics/server)
+caches = {
+    "resources": resource_listing,
+    "queue": queue_counts,
+    "labels": queue_labels,
+    "jobs": job_listing,
+}
+
+# Metrics that can be selected by label
+labelled_metrics = ["job_queue_state_%s_count" % name for name in job_states.values()]
+
+# Counters updated from job events, if enabled (see --queue-events)
+queue_events = None
+
+
 def get_queue_metrics():
     """
-    Update metrics for counts of jobs in the queue
+    Get counts of jobs in each queue state, keyed by state name.
+    """
+    if queue_events is not None and queue_events.ready.is_set():
+        return queue_events.get()
+    return queue_counts.get()
+
 
-    See https://github.com/flux-framework/flux-core/blob/master/src/common/libjob/job.h#L45-L53
-    for identifiers.
+class Snapshot:
     """
-    jobs = flux.job.job_list(handle)
-    listing = jobs.get()
+    Lazy, memoized access to Flux data for one collection.
 
-    # Organize based on states
-    states = [x["state"] for x in listing["jobs"]]
-    counter = collections.Counter(states)
+    A request (or collection cycle) creates one snapshot, and every metric
+    computed from it shares the same resource listing and queue counts.
+    """
 
-    # Lookup of state name to integer
-    lookup = {
-        "new": 1,
-        "depend": 2,
-        "priority": 4,
-        "sched": 8,
-        "run": 16,
-        "cleanup": 32,
-        "inactive": 64,
-    }
+    def __init__(self, selector=None):
+        self._resources = None
+        self._queue = None
+        self._totals = None
+        self._jobs = None
+
+        # Labels (e.g., queue, user) to select queue counts by
+        self.selector = selector
+
+    @property
+    def resources(self):
+        if self._resources is None:
+            self._resources = resource_listing.get()
+        return self._resources
+
+    @property
+    def resource_index(self):
+        return resources.get_index(self.resources)
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            if self.selector:
+                self._queue = queue_labels.get().get(self.selector)
+            else:
+                self._queue = get_queue_metrics()
+        return self._queue
+
+    @property
+    def jobs(self):
+        """
+        Active jobs (a list of dicts with the attributes in job_attrs).
+        """
+        if self._jobs is None:
+            self._jobs = job_listing.get()
+        return self._jobs
+
+    @property
+    def totals(self):
+        if self._totals is None:
+            if queue_events is not None and queue_events.ready.is_set():
+                self._totals = queue_events.get_totals()
+            else:
+                self._totals = count_reached_states(self.queue)
+        return self._totals
+
+
+def count_reached_states(counts):
+    """
+    Count jobs that have reached each state, from counts of jobs in each state.
 
-    # This is how to get states
-    counts = {}
-    for stateint, count in counter.items():
-        state = flux.job.info.statetostr(stateint)
-        counts[state] = count
-    for state in lookup:
-        if state not in counts:
-            counts[state] = 0
-    return counts
+    Jobs move through states in order, so a job in a later state has passed
+    through the earlier ones. This is approximate when jobs skip states (e.g.,
+    an exception before running), which event driven counts do not suffer.
+    """
+    totals = {}
+    reached = 0
+    for state in reversed(list(job_states.values())):
+        reached += counts[state]
+        totals[state] = reached
+    return totals
 
 
 # Queue states
 
 
-def job_queue_state_new_count():
-    return get_queue_metrics()["new"]
+def job_queue_state_new_count(snapshot):
+    """
+    Number of jobs in the queue in state new
+    """
+    return snapshot.queue["new"]
+
+
+def job_queue_state_depend_count(snapshot):
+    """
+    Number of jobs in the queue in state depend
+    """
+    return snapshot.queue["depend"]
+
+
+def job_queue_state_priority_count(snapshot):
+    """
+    Number of jobs in the queue in state priority
+    """
+    return snapshot.queue["priority"]
 
 
-def job_queue_state_depend_count():
-    return get_queue_metrics()["depend"]
+def job_queue_state_sched_count(snapshot):
+    """
+    Number of jobs in the queue in state sched
+    """
+    return snapshot.queue["sched"]
 
 
-def job_queue_state_priority_count():
-    return get_queue_metrics()["priority"]
+def job_queue_state_run_count(snapshot):
+    """
+    Number of jobs in the queue in state run
+    """
+    return snapshot.queue["run"]
 
 
-def job_queue_state_sched_count():
-    return get_queue_metrics()["sched"]
+def job_queue_state_cleanup_count(snapshot):
+    """
+    Number of jobs in the queue in state cleanup
+    """
+    return snapshot.queue["cleanup"]
 
 
-def job_queue_state_run_count():
-    return get_queue_metrics()["run"]
+def job_queue_state_inactive_count(snapshot):
+    """
+    Number of jobs in the queue in state inactive
 
+    Counting them by queue needs the job stats RPC, so without it we fail
+    instead of returning 0.
+    """
+    if snapshot.selector and not queue_labels.get().has_inactive:
+        raise ValueError("Counting inactive jobs by queue needs the job-list stats RPC")
+    return snapshot.queue["inactive"]
 
-def job_queue_state_cleanup_count():
-    return get_queue_metrics()["cleanup"]
 
+# Throughput, from successive snapshots
 
-def job_queue_state_inactive_count():
-    return get_queue_metrics()["inactive"]
+rates = {
+    "job_submit_rate": Rate(),
+    "job_sched_rate": Rate(),
+    "job_start_rate": Rate(),
+    "job_complete_rate": Rate(),
+    "node_cores_freed_rate": Rate(),
+}
 
 
-def add_custom_metrics(metric_file):
+def observe_rate(metric_name, value):
     """
-    Add custom metrics to the server
+    Observe a cumulative value for a rate metric, returning the rate.
     """
-    global metrics
-    tmpdir = utils.get_tmpdir()
+    return rates[metric_name].observe(value)
 
-    # Copy our metrics file there and do relative import
-    custom_metrics_file = os.path.join(tmpdir, "custom_metrics.py")
-    shutil.copyfile(metric_file, custom_metrics_file)
-    spec = importlib.util.spec_from_file_location("custom_metrics", custom_metrics_file)
-    cm = importlib.util.module_from_spec(spec)
-    sys.modules["cm"] = cm
-    spec.loader.exec_module(cm)
 
-    # Discover the names, and add the functions!
-    for contender in dir(cm):
-        if contender.startswith("_"):
-            continue
-        func = getattr(cm, contender)
+def job_submit_rate(snapshot):
+    """
+    Jobs submitted per second
+    """
+    return observe_rate("job_submit_rate", snapshot.totals["new"])
+
+
+def job_sched_rate(snapshot):
+    """
+    Jobs entering the sched state (ready to be scheduled) per second
+    """
+    return observe_rate("job_sched_rate", snapshot.totals["sched"])
+
 
-        # We only care about functions
-        if func.__class__.__name__ == "function":
-            args = inspect.signature(func)
+def job_start_rate(snapshot):
+    """
+    Jobs starting to run per second
+    """
+    return observe_rate("job_start_rate", snapshot.totals["run"])
+
+
+def job_complete_rate(snapshot):
+    """
+    Jobs completing (becoming inactive) per second
+    """
+    return observe_rate("job_complete_rate", snapshot.totals["inactive"])
 
-            # Must have at least one argument (the handle)
-            # We could be more strict here, but this is probably OK
-            if len(args.parameters) == 0:
-                sys.exit(f"{contender} is not a valid function - has no arguments")
-            print(f"Adding custom function {contender} to metrics.")
-            custom_metrics[contender] = func
 
-    # Cleanup
-    shutil.rmtree(tmpdir)
+def node_cores_freed_rate(snapshot):
+    """
+    Net node cores freed per second, from increases in free cores
+
+    Cores allocated and freed between two collections cancel out, so this
+    is a lower bound even with --queue-events.
+    """
+    return observe_rate("node_cores_freed_rate", snapshot.resources.free.ncores)
+
+
+def collect_object(kind, name, metric_name, snapshot=None):
+    """
+    Collect a metric for one object (e.g., a Node), or None if it is unknown.
+    """
+    snapshot = snapshot or Snapshot()
+    counts = snapshot.resource_index.get(kind, name)
+    if counts is None:
+        return None
+    return counts[object_metrics[metric_name]]
+
+
+def collect(metric_name, snapshot=None, deadline=None):
+    """
+    Collect the current value of a built-in or custom metric.
+
+    This blocks on the broker, so the server runs it off of the event loop.
+    A custom metric stops waiting at the deadline (monotonic), if given.
+    """
+    with instrument.timed(instrument.collect_seconds, metric_name):
+        if metric_name in custom_metrics:
+            return custom_metrics[metric_name].collect(snapshot, deadline=deadline)
+        return metrics[metric_name](snapshot or Snapshot())
 
 
 # Organize metrics by name
@@ -173,6 +451,8 @@ metrics = {
     "node_cores_up_count": node_core_up_count,
     "node_free_count": node_free_count,
     "node_up_count": node_up_count,
+    "node_gpus_free_count": node_gpus_free_count,
+    "node_gpus_up_count": node_gpus_up_count,
     # Queue states
     "job_queue_state_new_count": job_queue_state_new_count,
     "job_queue_state_depend_count": job_queue_state_depend_count,
@@ -181,7 +461,13 @@ metrics = {
     "job_queue_state_run_count": job_queue_state_run_count,
     "job_queue_state_cleanup_count": job_queue_state_cleanup_count,
     "job_queue_state_inactive_count": job_queue_state_inactive_count,
+    # Throughput
+    "job_submit_rate": job_submit_rate,
+    "job_sched_rate": job_sched_rate,
+    "job_start_rate": job_start_rate,
+    "job_complete_rate": job_complete_rate,
+    "node_cores_freed_rate": node_cores_freed_rate,
 }
 
-# Custom metrics defined by the user (have the handle provided)
+# Custom metrics defined by the user (plugins, see plugins.py)
 custom_metrics = {}
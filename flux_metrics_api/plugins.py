@@ -0,0 +1,215 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import importlib.metadata
+import importlib.util
+import inspect
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.instrument as instrument
+import flux_metrics_api.metrics as metrics
+
+# Packages can provide custom metrics as entry points in this group
+ENTRY_POINT_GROUP = "flux_metrics_api.metrics"
+
+# Each custom metrics file is imported as a uniquely named module
+module_counter = itertools.count()
+
+
+class PluginTimeout(Exception):
+    """
+    A custom metric did not return in time (or is still running from before).
+    """
+
+
+def metric(ttl=None, timeout=None):
+    """
+    Decorate a custom metric function to declare a cache ttl and timeout.
+
+    @metric(ttl=30, timeout=5)
+    def my_custom_metric(handle):
+        ...
+    """
+
+    def decorator(func):
+        func.ttl = ttl
+        func.timeout = timeout
+        return func
+
+    return decorator
+
+
+class Plugin:
+    """
+    A custom metric, run in its own thread with a time limit.
+
+    Each plugin has a single worker thread, so a slow or hanging plugin only
+    holds up its own metric. Python threads cannot be killed, so while a call
+    is still running after its timeout, new calls fail fast instead of
+    queueing behind it. Entry points are not imported until first use.
+    """
+
+    def __init__(self, name, func=None, entry_point=None):
+        self.name = name
+        self.func = func
+        self.entry_point = entry_point
+        self.reset()
+        self.value = None
+        self.updated = None
+        if func is not None:
+            self.validate()
+
+    def reset(self):
+        """
+        Start over with a new thread, e.g., in a forked worker.
+
+        A forked process inherits the executor but not its thread, so work
+        submitted to it would never run.
+        """
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"flux-metrics-{self.name}"
+        )
+        self.running = None
+        self.started = None
+
+    @property
+    def wants_snapshot(self):
+        """
+        A function with a second argument is passed the snapshot, too.
+        """
+        return len(inspect.signature(self.func).parameters) > 1
+
+    @property
+    def ttl(self):
+        return getattr(self.func, "ttl", None) or 0
+
+    @property
+    def timeout(self):
+        return getattr(self.func, "timeout", None) or defaults.METRIC_TIMEOUT
+
+    def validate(self):
+        """
+        Custom metrics must have at least one argument (the handle)
+        """
+        if len(inspect.signature(self.func).parameters) == 0:
+            raise ValueError(f"{self.name} is not a valid function - has no arguments")
+
+    def load(self):
+        """
+        Import the function for an entry point, if we haven't yet.
+        """
+        if self.func is None:
+            self.func = self.entry_point.load()
+            self.validate()
+        return self.func
+
+    def run(self, snapshot=None):
+        """
+        Run the function (in the plugin thread) with a handle for the thread.
+        """
+        func = self.load()
+        with instrument.timed(instrument.call_seconds, f"custom:{self.name}"):
+            if self.wants_snapshot:
+                return func(metrics.get_handle(), snapshot or metrics.Snapshot())
+            return func(metrics.get_handle())
+
+    def collect(self, snapshot=None, deadline=None):
+        """
+        Collect the metric, from the cache if it is fresh.
+
+        The snapshot (if given) is shared with the metrics collected with it,
+        so a plugin that reads from it makes no extra RPCs. Concurrent callers
+        share the call in progress, and wait for what is left of its timeout.
+        We stop waiting at the deadline (monotonic), if it comes first.
+        """
+        with self.lock:
+            if self.updated is not None and self.ttl:
+                if time.monotonic() - self.updated < self.ttl:
+                    return self.value
+            if self.running is None or self.running.done():
+                self.running = self.executor.submit(self.run, snapshot)
+                self.started = time.monotonic()
+            elif time.monotonic() - self.started >= self.timeout:
+                raise PluginTimeout(
+                    f"{self.name} is still running from a previous call"
+                )
+            running, started = self.running, self.started
+
+        now = time.monotonic()
+        timeout = max(0, started + self.timeout - now)
+        if deadline is not None:
+            timeout = max(0, min(timeout, deadline - now))
+        try:
+            value = running.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise PluginTimeout(f"{self.name} did not return in {self.timeout} seconds")
+        with self.lock:
+            self.value = value
+            self.updated = time.monotonic()
+        return value
+
+
+def add_plugin(plugin):
+    """
+    Register a plugin as a custom metric.
+    """
+    if plugin.name in metrics.metrics:
+        sys.exit(f"{plugin.name} is already a built-in metric.")
+    if plugin.name in metrics.custom_metrics:
+        sys.exit(f"{plugin.name} is already a custom metric.")
+    print(f"Adding custom function {plugin.name} to metrics.")
+    metrics.custom_metrics[plugin.name] = plugin
+
+
+def add_custom_metrics(metric_file):
+    """
+    Add custom metrics (functions that take the handle) from a Python file
+    """
+    metric_file = os.path.abspath(metric_file)
+    module_name = f"flux_metrics_api_custom_{next(module_counter)}"
+    spec = importlib.util.spec_from_file_location(module_name, metric_file)
+    cm = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = cm
+    spec.loader.exec_module(cm)
+
+    # Discover the names, and add the functions!
+    for contender in dir(cm):
+        if contender.startswith("_"):
+            continue
+        func = getattr(cm, contender)
+
+        # We only care about functions defined in the file (and not imports)
+        if not inspect.isfunction(func) or func.__module__ != module_name:
+            continue
+        try:
+            add_plugin(Plugin(contender, func=func))
+        except ValueError as e:
+            sys.exit(str(e))
+
+
+def get_entry_points():
+    """
+    Get entry points for custom metrics from installed packages.
+    """
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=ENTRY_POINT_GROUP)
+    return entry_points.get(ENTRY_POINT_GROUP, [])
+
+
+def add_entry_points():
+    """
+    Add custom metrics from entry points, without importing them yet.
+    """
+    for entry_point in get_entry_points():
+        add_plugin(Plugin(entry_point.name, entry_point=entry_point))
@@ -0,0 +1,59 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import inspect
+import math
+import numbers
+
+import flux_metrics_api.metrics as metrics
+
+# Version 0.0.4 of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def get_help(metric_name):
+    """
+    Get the help for a metric from the first line of its docstring.
+    """
+    func = metrics.metrics.get(metric_name) or metrics.custom_metrics.get(metric_name)
+
+    # Custom metrics are plugins that wrap the function (once it is loaded)
+    func = getattr(func, "func", func)
+    doc = inspect.getdoc(func) if func is not None else None
+    if not doc:
+        return f"Flux metric {metric_name}"
+    helptext = doc.strip().splitlines()[0]
+    return helptext.replace("\\", "\\\\")
+
+
+def format_value(value):
+    """
+    Format a number as a Prometheus sample value.
+    """
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def render(values):
+    """
+    Render metric values (keyed by name) in the Prometheus text format.
+
+    Values that are not numbers cannot be exposed and are skipped.
+    """
+    lines = []
+    for metric_name, value in values.items():
+        if not isinstance(value, numbers.Real):
+            continue
+        lines.append(f"# HELP {metric_name} {get_help(metric_name)}")
+        lines.append(f"# TYPE {metric_name} gauge")
+        lines.append(f"{metric_name} {format_value(value)}")
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
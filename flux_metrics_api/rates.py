@@ -0,0 +1,46 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import threading
+import time
+
+import flux_metrics_api.defaults as defaults
+
+
+class Rate:
+    """
+    The rate of increase (per second) of a value, from successive observations.
+
+    Increases between observations are summed, and the rate is updated once
+    at least defaults.RATE_INTERVAL seconds have passed, so frequent polling
+    does not make it noisy. Decreases (e.g., purged inactive jobs, or cores
+    being allocated) are not counted. Each observation is O(1).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = None
+        self.start = None
+        self.increase = 0
+        self.rate = 0.0
+
+    def observe(self, value, now=None):
+        """
+        Observe the current value, and return the current rate.
+        """
+        now = now or time.monotonic()
+        with self.lock:
+            if self.last is None:
+                self.start = now
+            else:
+                self.increase += max(0, value - self.last)
+            self.last = value
+
+            elapsed = now - self.start
+            if elapsed > 0 and elapsed >= defaults.RATE_INTERVAL:
+                self.rate = self.increase / elapsed
+                self.increase = 0
+                self.start = now
+            return self.rate
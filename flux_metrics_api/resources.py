@@ -0,0 +1,144 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import collections
+import json
+import re
+import threading
+
+# Resource sets in a resource listing that we index
+states = ["up", "free"]
+
+# Kinds of objects we index, by the resource in a request path
+kinds = {
+    "nodes": "Node",
+    "node": "Node",
+    "properties": "Property",
+    "property": "Property",
+}
+
+# A host (or range of hosts) in a hostlist, as prefix[idset]suffix
+hostlist_pattern = re.compile(r"([^,\[\]]*)(?:\[([^\]]*)\])?([^,\[\]]*),?")
+
+
+def expand_ids(idset):
+    """
+    Expand an idset string (e.g., 0-3,5) into a list of integers.
+    """
+    ids = []
+    for part in str(idset).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            ids += range(int(start), int(end) + 1)
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def expand_hostlist(hostlist):
+    """
+    Expand a hostlist (e.g., node[0-3,7],login) into hostnames.
+
+    This is used when the Flux bindings (and flux.hostlist) are not installed.
+    """
+    hosts = []
+    for prefix, idset, suffix in hostlist_pattern.findall(hostlist):
+        if not idset:
+            if prefix or suffix:
+                hosts.append(prefix + suffix)
+            continue
+        for part in idset.split(","):
+            start, _, end = part.partition("-")
+            width = len(start)
+            for i in range(int(start), int(end or start) + 1):
+                hosts.append(f"{prefix}{i:0{width}d}{suffix}")
+    return hosts
+
+
+def expand_hosts(nodelist):
+    """
+    Expand a list of hostlists (e.g., ["node[0-3]"]) into hostnames.
+    """
+    try:
+        import flux.hostlist
+    except ImportError:
+        return [host for hostlist in nodelist for host in expand_hostlist(hostlist)]
+
+    hosts = []
+    for hostlist in nodelist:
+        hosts += list(flux.hostlist.Hostlist(hostlist))
+    return hosts
+
+
+class ResourceIndex:
+    """
+    Counts of cores, gpus, and nodes up and free, by node and by property.
+
+    This is built once from a resource listing, so a metric for any one
+    node or property is a dictionary lookup.
+    """
+
+    def __init__(self, listing):
+        self.objects = {
+            "Node": collections.defaultdict(collections.Counter),
+            "Property": collections.defaultdict(collections.Counter),
+        }
+        for state in states:
+            self.add(state, getattr(listing, state))
+
+    def add(self, state, rset):
+        """
+        Add counts for one resource set (e.g., free) from its R.
+        """
+        execution = json.loads(rset.encode()).get("execution", {})
+        entries = execution.get("R_lite", [])
+
+        # Hosts are listed in order of ranks
+        ranks = sorted(rank for entry in entries for rank in expand_ids(entry["rank"]))
+        hosts = dict(zip(ranks, expand_hosts(execution.get("nodelist", []))))
+
+        properties = collections.defaultdict(list)
+        for prop, idset in execution.get("properties", {}).items():
+            for rank in expand_ids(idset):
+                properties[rank].append(prop)
+
+        for entry in entries:
+            children = entry.get("children", {})
+            cores = len(expand_ids(children.get("core", "")))
+            gpus = len(expand_ids(children.get("gpu", "")))
+            for rank in expand_ids(entry["rank"]):
+                counts = {
+                    f"{state}_cores": cores,
+                    f"{state}_gpus": gpus,
+                    f"{state}_nodes": 1,
+                }
+                self.objects["Node"][hosts.get(rank, str(rank))].update(counts)
+                for prop in properties[rank]:
+                    self.objects["Property"][prop].update(counts)
+
+    def get(self, kind, name):
+        """
+        Get counts for an object, or None if it is not known.
+        """
+        return self.objects[kind].get(name)
+
+
+# The last index, reused while the resource listing is the same
+last_index = {"listing": None, "index": None}
+lock = threading.Lock()
+
+
+def get_index(listing):
+    """
+    Get the index for a resource listing, building it once per listing.
+    """
+    with lock:
+        if last_index["listing"] is not listing:
+            last_index["index"] = ResourceIndex(listing)
+            last_index["listing"] = listing
+        return last_index["index"]
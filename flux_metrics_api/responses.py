@@ -0,0 +1,146 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import hashlib
+import json
+
+from starlette.responses import JSONResponse as BaseJSONResponse
+from starlette.responses import Response
+
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.types as types
+
+# orjson is optional, and much faster than the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Static parts of a MetricValueList, rendered once defaults are final
+envelope = None
+
+
+def dumps(data):
+    """
+    Serialize data to compact JSON bytes, with orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(
+        data, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class JSONResponse(BaseJSONResponse):
+    """
+    A JSON response serialized with our (faster) encoder.
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+class MetricResponse(Response):
+    """
+    A pre-rendered MetricValueList response.
+    """
+
+    media_type = "application/json"
+
+
+class CachedDocument:
+    """
+    A JSON document rendered once and served with an ETag.
+
+    Clients that send the ETag back (If-None-Match) get a 304 without a body.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.body = None
+        self.etag = None
+
+    def prepare(self):
+        """
+        Render (or re-render) the document.
+        """
+        self.body = dumps(self.func())
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()
+
+    def matches(self, request):
+        """
+        Determine if the request already has the current document.
+        """
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        etags = [x.strip() for x in header.split(",")]
+        etags = [x[2:] if x.startswith("W/") else x for x in etags]
+        return "*" in etags or self.etag in etags
+
+    def response(self, request):
+        if self.body is None:
+            self.prepare()
+        headers = {"ETag": self.etag}
+        if self.matches(request):
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+def prepare():
+    """
+    Render the static parts of a MetricValueList.
+
+    This needs to be called again if the namespace, service name, or API
+    root change, and is otherwise done on first use.
+    """
+    global envelope
+    described = types.new_described_object()
+    listing = types.new_metric_list([], metadata={"selfLink": defaults.API_ROOT})
+    del listing["items"]
+
+    # The items are first, so the rest of the listing follows them
+    envelope = {
+        "describedObject": dumps(described),
+        "prefix": b'{"items":[',
+        "suffix": b"]," + dumps(listing)[1:],
+    }
+    return envelope
+
+
+def render_metric(metric, value, timestamp=None, windowSeconds=0, describedObject=None):
+    """
+    Render one metric value, equivalent to dumps(types.new_metric(...)).
+    """
+    if envelope is None:
+        prepare()
+    if describedObject is None:
+        described = envelope["describedObject"]
+    else:
+        described = dumps(describedObject)
+    return b"".join(
+        [
+            b'{"metric":',
+            dumps(metric),
+            b',"value":',
+            dumps(value),
+            b',"timestamp":',
+            dumps(timestamp or types.get_timestamp()),
+            b',"windowSeconds":',
+            dumps(windowSeconds),
+            b',"describedObject":',
+            described,
+            b"}",
+        ]
+    )
+
+
+def render_metric_list(items):
+    """
+    Render a MetricValueList from rendered metric values.
+    """
+    if envelope is None:
+        prepare()
+    return envelope["prefix"] + b",".join(items) + envelope["suffix"]
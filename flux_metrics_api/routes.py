@@ -3,16 +3,43 @@
 #
 # SPDX-License-Identifier: (MIT)
 
+import asyncio
+import datetime
+import math
+import time
+
 from apispec import APISpec
 from starlette.endpoints import HTTPEndpoint
-from starlette.responses import JSONResponse
 from starlette.routing import Route
 from starlette_apispec import APISpecSchemaGenerator
 
+import flux_metrics_api.access as access
+import flux_metrics_api.collector as collector
 import flux_metrics_api.defaults as defaults
+import flux_metrics_api.executor as executor
+import flux_metrics_api.history as history
+import flux_metrics_api.instrument as instrument
+import flux_metrics_api.labels as labels
+import flux_metrics_api.plugins as plugins
+import flux_metrics_api.prometheus as prometheus
+import flux_metrics_api.resources as resources
+import flux_metrics_api.responses as responses
+import flux_metrics_api.stale as stale
+import flux_metrics_api.store as store
 import flux_metrics_api.types as types
+import flux_metrics_api.utils as utils
 import flux_metrics_api.version as version
-from flux_metrics_api.metrics import custom_metrics, handle, metrics
+from flux_metrics_api.logger import logger
+from flux_metrics_api.metrics import (
+    Snapshot,
+    caches,
+    collect,
+    collect_object,
+    custom_metrics,
+    labelled_metrics,
+    metrics,
+    object_metrics,
+)
 
 schemas = APISpecSchemaGenerator(
     APISpec(
@@ -23,7 +50,11 @@ schemas = APISpecSchemaGenerator(
     )
 )
 
-not_found_response = JSONResponse(
+# Fraction of the metric timeout left for a batch to return the metrics that
+# did not time out (custom metrics stop waiting before it)
+BATCH_MARGIN = 0.1
+
+not_found_response = responses.JSONResponse(
     {"detail": "The metric server is not running in a Kubernetes pod."},
     status_code=404,
 )
@@ -38,10 +69,22 @@ class Root(HTTPEndpoint):
     """
 
     async def get(self, request):
-        return JSONResponse(types.new_resource_list())
+        return resource_list.response(request)
 
 
-def get_metric(request):
+def parse_metric_names(metric_name):
+    """
+    Parse a requested metric name into a list of names.
+
+    This can be one name, a comma separated list, or * for all metrics.
+    """
+    if metric_name == "*":
+        return collector.get_metric_names()
+    names = [x.strip() for x in metric_name.split(",") if x.strip()]
+    return list(dict.fromkeys(names))
+
+
+async def get_metric(request):
     """
     Shared function to get and return a metric response
 
@@ -49,32 +92,236 @@ def get_metric(request):
     we are just running inside a single namespace we don't care.
     """
     metric_name = request.path_params["metric_name"]
-    namespace = request.path_params.get("namespace")
-    print(f"Requested metric {metric_name} in  namespace {namespace}")
 
     # TODO we don't do anything with namespace currently, we assume we won't
     # be able to hit this if running in the wrong one
     # Unknown metric
-    if metric_name not in metrics and metric_name not in custom_metrics:
-        print(f"Unknown metric requested {metric_name}")
-        return JSONResponse(
+    metric_names = parse_metric_names(metric_name)
+    unknown = [x for x in metric_names if x not in metrics and x not in custom_metrics]
+    if unknown or not metric_names:
+        return responses.JSONResponse(
             {"detail": "This metric is not known to the server."}, status_code=404
         )
 
-    # Prepare the metric
-    metric = types.new_identifier(metric_name)
+    # Metrics for one object (e.g., /nodes/node-0/node_cores_free_count)
+    if "resource" in request.path_params:
+        request.state.outcome = "miss"
+        return await get_object_metric(request, metric_names)
+
+    # Queue metrics selected by labels (e.g., queue=batch) are always collected
+    if "labelSelector" in request.query_params:
+        request.state.outcome = "miss"
+        return await get_labelled_metric(request, metric_names)
+
+    # Summarize samples from the background collector over a window
+    if "window" in request.query_params:
+        return get_windowed_metric(request, metric_names)
+
+    # The background collector has a response ready
+    if len(metric_names) == 1:
+        response = collector.rendered.get(metric_names[0])
+        if response is not None and collector.is_fresh(metric_names[0]):
+            return responses.MetricResponse(response)
+
+    # Use values from the background collector, and collect the rest together
+    timestamp = None
+    values = collector.values
+    missing = [x for x in metric_names if x not in values or not collector.is_fresh(x)]
+    if missing:
+        request.state.outcome = "miss"
+        try:
+            collected, timestamp = await stale.collect(
+                ("metrics", tuple(missing)), collect_metrics, missing
+            )
+        except (asyncio.TimeoutError, plugins.PluginTimeout):
+            return responses.JSONResponse(
+                {"detail": f"Timed out collecting metric {metric_name}."},
+                status_code=504,
+            )
+        except Exception as e:
+            return responses.JSONResponse(
+                {"detail": f"Cannot collect metric {metric_name}: {e}"},
+                status_code=503,
+            )
+        values = {**values, **collected}
+    values = {x: values[x] for x in metric_names if x in values}
+    return responses.MetricResponse(collector.render(values, timestamp=timestamp))
+
+
+def get_windowed_metric(request, metric_names):
+    """
+    Get metrics summarized over a window (e.g., ?window=60s&aggregate=max)
+
+    The windowSeconds reported is the time the samples cover (rounded up to
+    whole seconds), which is less than asked for if we don't have samples
+    that old (e.g., the server just started, or --history-size is too small).
+    """
+    try:
+        seconds = utils.parse_duration(request.query_params["window"])
+    except ValueError as e:
+        return responses.JSONResponse({"detail": str(e)}, status_code=400)
+    if not seconds:
+        return responses.JSONResponse(
+            {"detail": "window must be longer than 0 seconds"}, status_code=400
+        )
+    aggregate = request.query_params.get("aggregate", "avg")
+    if aggregate not in history.aggregates:
+        return responses.JSONResponse(
+            {"detail": f"aggregate must be one of {', '.join(history.aggregates)}"},
+            status_code=400,
+        )
+
+    values = {}
+    covered = seconds
+    for metric_name in metric_names:
+        summary = history.summarize(metric_name, seconds, aggregate)
+        if summary is None:
+            return responses.JSONResponse(
+                {
+                    "detail": f"There are no samples for {metric_name}, is the server running with --collect-interval?"
+                },
+                status_code=404,
+            )
+        values[metric_name], span = summary
+        covered = min(covered, span)
+    windowSeconds = max(1, math.ceil(covered))
+    return responses.MetricResponse(
+        collector.render(values, windowSeconds=windowSeconds)
+    )
+
+
+async def get_object_metric(request, metric_names):
+    """
+    Get metrics for a node (or nodes with a property) from the resource index.
+    """
+    resource = request.path_params["resource"]
+    name = request.path_params["name"]
+    kind = resources.kinds.get(resource)
+    if kind is None:
+        return responses.JSONResponse(
+            {
+                "detail": f"{resource} is not a supported resource, choices are {', '.join(resources.kinds)}"
+            },
+            status_code=404,
+        )
+    if request.path_params["metric_name"] == "*":
+        metric_names = list(object_metrics)
+    unsupported = [x for x in metric_names if x not in object_metrics]
+    if unsupported:
+        return responses.JSONResponse(
+            {
+                "detail": f"These metrics are not available for {resource}: {', '.join(unsupported)}"
+            },
+            status_code=400,
+        )
+
+    try:
+        values, timestamp = await stale.collect(
+            ("object", kind, name, tuple(metric_names)),
+            collect_objects,
+            kind,
+            name,
+            metric_names,
+        )
+    except asyncio.TimeoutError:
+        return responses.JSONResponse(
+            {"detail": "Timed out collecting metrics."}, status_code=504
+        )
+    except Exception as e:
+        return responses.JSONResponse(
+            {"detail": f"Cannot collect metrics: {e}"}, status_code=503
+        )
+    if values is None:
+        return responses.JSONResponse(
+            {"detail": f"{resource} {name} is not known to the server."},
+            status_code=404,
+        )
+    describedObject = types.new_described_object(kind=kind, name=name)
+    return responses.MetricResponse(
+        collector.render(values, timestamp=timestamp, describedObject=describedObject)
+    )
+
+
+def collect_objects(kind, name, metric_names):
+    """
+    Collect metrics for one object from one snapshot, or None if it is unknown.
+    """
+    snapshot = Snapshot()
+    values = {}
+    for metric_name in metric_names:
+        value = collect_object(kind, name, metric_name, snapshot)
+        if value is None:
+            return None
+        values[metric_name] = value
+    return values
+
+
+async def get_labelled_metric(request, metric_names):
+    """
+    Get queue metrics selected by labels (e.g., ?labelSelector=queue=batch)
+    """
+    unsupported = [x for x in metric_names if x not in labelled_metrics]
+    if unsupported:
+        return responses.JSONResponse(
+            {
+                "detail": f"These metrics cannot be selected by label: {', '.join(unsupported)}"
+            },
+            status_code=400,
+        )
+    try:
+        selector = labels.parse_selector(request.query_params["labelSelector"])
+    except ValueError as e:
+        return responses.JSONResponse({"detail": str(e)}, status_code=400)
+
+    # Inactive jobs are only counted by queue (we don't list the job history)
+    inactive = "job_queue_state_inactive_count"
+    if inactive in metric_names and list(selector) != ["queue"]:
+        return responses.JSONResponse(
+            {"detail": f"{inactive} can only be selected by queue"}, status_code=400
+        )
 
-    # Get the value from Flux, assemble into listing
-    if metric_name in custom_metrics:
-        value = custom_metrics[metric_name](handle)
-    else:
-        value = metrics[metric_name]()
-    metric_value = types.new_metric(metric, value=value)
+    try:
+        values, timestamp = await stale.collect(
+            ("labels", tuple(sorted(selector.items())), tuple(metric_names)),
+            collect_metrics,
+            metric_names,
+            selector,
+        )
+    except asyncio.TimeoutError:
+        return responses.JSONResponse(
+            {"detail": "Timed out collecting metrics."}, status_code=504
+        )
+    except Exception as e:
+        return responses.JSONResponse(
+            {"detail": f"Cannot collect metrics: {e}"}, status_code=503
+        )
+    return responses.MetricResponse(
+        collector.render(values, timestamp=timestamp, selector=selector)
+    )
 
-    # Give the endpoint for the service as metadata
-    metadata = {"selfLink": defaults.API_ROOT}
-    listing = types.new_metric_list([metric_value], metadata=metadata)
-    return JSONResponse(listing)
+
+def collect_metrics(metric_names, selector=None):
+    """
+    Collect metrics from one snapshot, so they share underlying Flux RPCs.
+
+    Like the background collector, metrics that fail are logged and left out,
+    so one bad metric (e.g., a hanging custom metric) does not fail the rest.
+    Custom metrics stop waiting in time for us to return the others before
+    the request times out. If every metric fails, we raise the first error.
+    """
+    snapshot = Snapshot(selector)
+    deadline = time.monotonic() + defaults.METRIC_TIMEOUT * (1 - BATCH_MARGIN)
+    values = {}
+    errors = []
+    for metric_name in metric_names:
+        try:
+            values[metric_name] = collect(metric_name, snapshot, deadline=deadline)
+        except Exception as e:
+            logger.warning(f"Cannot collect metric {metric_name}: {e}")
+            errors.append(e)
+    if errors and not values:
+        raise errors[0]
+    return values
 
 
 class Metric(HTTPEndpoint):
@@ -86,7 +333,13 @@ class Metric(HTTPEndpoint):
     """
 
     async def get(self, request):
-        return get_metric(request)
+        start = time.perf_counter()
+        response = await get_metric(request)
+
+        # Requests are misses if they collected any metric from Flux
+        outcome = getattr(request.state, "outcome", "hit")
+        access.log(request, response, outcome, start)
+        return response
 
 
 class APIGroupList(HTTPEndpoint):
@@ -95,10 +348,10 @@ class APIGroupList(HTTPEndpoint):
     """
 
     async def get(self, request):
-        listing = types.new_group_list()
+        listing = await executor.run(types.new_group_list)
         if not listing:
             return not_found_response
-        return JSONResponse(listing)
+        return responses.JSONResponse(listing)
 
 
 class OpenAPI(HTTPEndpoint):
@@ -108,17 +361,136 @@ class OpenAPI(HTTPEndpoint):
 
     async def get(self, request):
         version = request.path_params["version"]
-        openapi = types.get_cluster_schema(version)
+        openapi = await executor.run(types.get_cluster_schema, version)
         if not openapi:
             return not_found_response
-        return JSONResponse(openapi)
+        return responses.JSONResponse(openapi)
+
+
+async def prometheus_metrics(request):
+    """
+    Expose all metrics in the Prometheus text format.
+
+    We use the values from the background collector if it is running, and
+    otherwise collect them all from one snapshot.
+    """
+    values = collector.values
+    if defaults.MAX_STALENESS:
+        values = {x: v for x, v in values.items() if collector.is_fresh(x)}
+    if not values:
+        try:
+            values, _ = await stale.collect(("all",), collector.collect_values)
+        except asyncio.TimeoutError:
+            return responses.JSONResponse(
+                {"detail": "Timed out collecting metrics."}, status_code=504
+            )
+    return responses.Response(
+        prometheus.render(values), media_type=prometheus.CONTENT_TYPE
+    )
+
+
+def parse_time(text):
+    """
+    Parse a time (an RFC 3339 timestamp, or a duration before now) into seconds.
+    """
+    # Older Pythons cannot parse a Z for UTC
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    try:
+        return time.time() - utils.parse_duration(text)
+    except ValueError:
+        raise ValueError(f"{text} is not a timestamp or duration (e.g., 1h)")
+
+
+async def metric_history(request):
+    """
+    Get the recorded history of a metric (e.g., /history/node_up_count?since=1h)
+
+    This is read from the files in --history-dir, oldest first, and since
+    and until (timestamps, or durations before now) are inclusive.
+    """
+    if not store.directory:
+        return responses.JSONResponse(
+            {"detail": "The server is not running with --history-dir."},
+            status_code=404,
+        )
+    metric_name = request.path_params["metric_name"]
+    try:
+        since = 0
+        if "since" in request.query_params:
+            since = parse_time(request.query_params["since"])
+        until = None
+        if "until" in request.query_params:
+            until = parse_time(request.query_params["until"])
+    except ValueError as e:
+        return responses.JSONResponse({"detail": str(e)}, status_code=400)
+    limit = request.query_params.get("limit", str(defaults.HISTORY_LIMIT))
+    if not limit.isdigit() or int(limit) < 1:
+        return responses.JSONResponse(
+            {"detail": f"limit must be a number of samples (at least 1), not {limit}"},
+            status_code=400,
+        )
+    limit = min(int(limit), defaults.HISTORY_LIMIT)
+
+    # Ask for one more record than the limit to know if there are more
+    records = await executor.run(store.read, metric_name, since, until, limit + 1)
+    if records is None:
+        return responses.JSONResponse(
+            {"detail": f"There is no history for {metric_name}."}, status_code=404
+        )
+    samples = [
+        {
+            "timestamp": datetime.datetime.fromtimestamp(
+                timestamp, datetime.timezone.utc
+            ).isoformat(),
+            "value": value,
+        }
+        for timestamp, value in records[:limit]
+    ]
+    return responses.JSONResponse(
+        {
+            "metric": {"name": metric_name},
+            "samples": samples,
+            "truncated": len(records) > limit,
+        }
+    )
+
+
+def server_metrics(request):
+    """
+    Expose measurements of the server itself, if it is running with --verbose.
+    """
+    if not instrument.enabled:
+        return responses.JSONResponse(
+            {"detail": "The server is not running with --verbose."}, status_code=404
+        )
+    return responses.Response(
+        instrument.render(caches), media_type=prometheus.CONTENT_TYPE
+    )
 
 
 def openapi_schema(request):
     """
     Get the openapi spec from the endpoints
     """
-    return JSONResponse(schemas.get_schema(routes=routes))
+    return schema.response(request)
+
+
+# These documents only change when metrics do, so we render them once
+resource_list = responses.CachedDocument(types.new_resource_list)
+schema = responses.CachedDocument(lambda: schemas.get_schema(routes=routes))
+
+
+def prepare_documents():
+    """
+    Render the resource list and schema, after custom metrics are added.
+    """
+    resource_list.prepare()
+    schema.prepare()
 
 
 routes = [
@@ -133,6 +505,9 @@ routes = [
         Metric,
     ),
     # These are for our endpoints
+    Route("/metrics", prometheus_metrics, include_in_schema=False),
+    Route("/metrics/server", server_metrics, include_in_schema=False),
+    Route("/history/{metric_name}", metric_history, include_in_schema=False),
     Route("/schema", openapi_schema, include_in_schema=False),
     Route(f"{defaults.API_ROOT}/openapi/v2", openapi_schema, include_in_schema=False),
 ]
@@ -6,6 +6,8 @@
 # SPDX-License-Identifier: (MIT)
 
 import argparse
+import asyncio
+import contextlib
 import os
 import sys
 
@@ -13,10 +15,83 @@ import uvicorn
 from starlette.applications import Starlette
 
 import flux_metrics_api
+import flux_metrics_api.access as access
+import flux_metrics_api.backends as backends
+import flux_metrics_api.collector as collector
 import flux_metrics_api.defaults as defaults
+import flux_metrics_api.events as events
+import flux_metrics_api.instrument as instrument
 import flux_metrics_api.metrics as metrics
+import flux_metrics_api.plugins as plugins
+import flux_metrics_api.responses as responses
+import flux_metrics_api.store as store
+import flux_metrics_api.utils as utils
+import flux_metrics_api.workers as workers
 from flux_metrics_api.logger import setup_logger
-from flux_metrics_api.routes import routes
+from flux_metrics_api.routes import prepare_documents, routes
+
+
+def add_synthetic_arguments(parser):
+    """
+    Add arguments to generate synthetic Flux data with.
+    """
+    parser.add_argument(
+        "--jobs",
+        help="Synthetic jobs to generate (defaults to 1000).",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "--nodes",
+        help="Synthetic nodes to generate (defaults to 16).",
+        default=16,
+        type=int,
+    )
+    parser.add_argument(
+        "--cores", help="Cores per synthetic node (defaults to 8).", default=8, type=int
+    )
+    parser.add_argument(
+        "--gpus", help="Gpus per synthetic node (defaults to 0).", default=0, type=int
+    )
+    parser.add_argument(
+        "--active",
+        help="Fraction of synthetic jobs that are active, not inactive (defaults to 0.1).",
+        default=0.1,
+        type=float,
+    )
+    parser.add_argument(
+        "--queues",
+        help="Comma separated queues to split synthetic jobs and nodes across (defaults to batch,debug).",
+        default="batch,debug",
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed to generate synthetic data with (defaults to 0).",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--latency",
+        help="Seconds (e.g., 50ms) each call for synthetic data takes (defaults to 0).",
+        default=0,
+        type=utils.parse_duration,
+    )
+
+
+def get_synthetic_options(args):
+    """
+    Get options for the synthetic backend from parsed arguments.
+    """
+    return {
+        "nodes": args.nodes,
+        "cores": args.cores,
+        "gpus": args.gpus,
+        "jobs": args.jobs,
+        "active": args.active,
+        "queues": args.queues.split(","),
+        "seed": args.seed,
+        "latency": args.latency,
+    }
 
 
 def get_parser():
@@ -74,7 +149,13 @@ def get_parser():
     start.add_argument(
         "--service-name", help="Service name the metrics service is running from"
     )
-    start.add_argument("--custom-metric", help="A Python file with custom metrics")
+    start.add_argument(
+        "--custom-metric",
+        dest="custom_metric",
+        help="A Python file with custom metrics (can be provided more than once)",
+        action="append",
+        default=[],
+    )
     start.add_argument(
         "--api-path",
         dest="api_path",
@@ -88,7 +169,7 @@ def get_parser():
     )
     start.add_argument(
         "--verbose",
-        help="add verbose metrics about server usage and garbage collection (not related to Flux).",
+        help="add verbose metrics about server usage and garbage collection (not related to Flux) at /metrics/server.",
         default=False,
         action="store_true",
     )
@@ -98,11 +179,195 @@ def get_parser():
         default=False,
         action="store_true",
     )
+    start.add_argument(
+        "--resource-ttl",
+        dest="resource_ttl",
+        help="Seconds (e.g., 2s, 500ms) to share one resource listing across node metrics (defaults to 0).",
+        default=defaults.RESOURCE_TTL,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--queue-ttl",
+        dest="queue_ttl",
+        help="Seconds (e.g., 2s, 500ms) to share one job queue count across queue metrics (defaults to 0).",
+        default=defaults.QUEUE_TTL,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--queue-events",
+        dest="queue_events",
+        help="Count queue states from job events instead of listing jobs on each request.",
+        default=False,
+        action="store_true",
+    )
+    start.add_argument(
+        "--threads",
+        help=f"Threads to collect metrics from Flux with (defaults to {defaults.THREADS}).",
+        default=defaults.THREADS,
+        type=int,
+    )
+    start.add_argument(
+        "--metric-timeout",
+        dest="metric_timeout",
+        help=f"Seconds (e.g., 10s) to wait for a metric before returning a 504 (defaults to {defaults.METRIC_TIMEOUT}).",
+        default=defaults.METRIC_TIMEOUT,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--max-staleness",
+        dest="max_staleness",
+        help="Seconds (e.g., 60s) to serve the last good values (with their timestamp) while Flux is slow or failing (defaults to 0, never).",
+        default=defaults.MAX_STALENESS,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--stale-after",
+        dest="stale_after",
+        help=f"Seconds (e.g., 100ms) to wait for Flux before serving the last good values (defaults to {defaults.STALE_AFTER}).",
+        default=defaults.STALE_AFTER,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--collect-interval",
+        dest="collect_interval",
+        help="Seconds (e.g., 5s) between collecting all metrics in the background, to serve pre-rendered responses.",
+        default=defaults.COLLECT_INTERVAL,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--history-size",
+        dest="history_size",
+        help=f"Samples of each metric to keep for windowed metrics (defaults to {defaults.HISTORY_SIZE}).",
+        default=defaults.HISTORY_SIZE,
+        type=int,
+    )
+    start.add_argument(
+        "--history-dir",
+        dest="history_dir",
+        help="Directory to append the history of every collected metric to, to serve from /history and to warm windowed metrics on restart.",
+        default=defaults.HISTORY_DIR,
+    )
+    start.add_argument(
+        "--rate-interval",
+        dest="rate_interval",
+        help=f"Minimum seconds (e.g., 10s) between updates of rate metrics (defaults to {defaults.RATE_INTERVAL}).",
+        default=defaults.RATE_INTERVAL,
+        type=utils.parse_duration,
+    )
+    start.add_argument(
+        "--access-log",
+        dest="access_log",
+        help=f"Requests to log: none, errors, misses (collected from Flux), or all (defaults to {defaults.ACCESS_LOG}).",
+        choices=access.levels,
+        default=defaults.ACCESS_LOG,
+    )
+    start.add_argument(
+        "--access-log-sample",
+        dest="access_log_sample",
+        help="Fraction of requests that are not errors to log (defaults to 1).",
+        default=defaults.ACCESS_LOG_SAMPLE,
+        type=float,
+    )
+    start.add_argument(
+        "--workers",
+        help="Server processes to serve requests from, sharing one collector (defaults to 1).",
+        default=defaults.WORKERS,
+        type=int,
+    )
     start.add_argument("--ssl-keyfile", help="full path to ssl keyfile")
     start.add_argument("--ssl-certfile", help="full path to ssl certfile")
+    start.add_argument(
+        "--backend",
+        help="Where to get resources and jobs from, flux or synthetic (generated) data (defaults to flux).",
+        choices=list(backends.backends),
+        default="flux",
+    )
+    add_synthetic_arguments(start)
+
+    # Benchmark the server against synthetic Flux data
+    bench = subparsers.add_parser(
+        "bench",
+        description="Benchmark requests to each route against synthetic Flux data.",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    add_synthetic_arguments(bench)
+    bench.add_argument(
+        "--requests",
+        help="Requests to make to each route (defaults to 1000).",
+        default=1000,
+        type=int,
+    )
+    bench.add_argument(
+        "--warmup",
+        help="Requests to make to each route before measuring (defaults to 50).",
+        default=50,
+        type=int,
+    )
+    bench.add_argument(
+        "--concurrency",
+        help="Concurrent connections to make requests with (defaults to 16).",
+        default=16,
+        type=int,
+    )
+    bench.add_argument(
+        "--route",
+        help="A route to benchmark, e.g., node or selector (can be provided more than once, defaults to all but groups and openapi).",
+        action="append",
+        default=[],
+    )
+    bench.add_argument(
+        "--collect-interval",
+        dest="collect_interval",
+        help="Seconds (e.g., 5s) between collecting all metrics in the background (defaults to 0).",
+        default=defaults.COLLECT_INTERVAL,
+        type=utils.parse_duration,
+    )
+    bench.add_argument(
+        "--resource-ttl",
+        dest="resource_ttl",
+        help="Seconds (e.g., 2s) to share one resource listing across node metrics (defaults to 0).",
+        default=defaults.RESOURCE_TTL,
+        type=utils.parse_duration,
+    )
+    bench.add_argument(
+        "--queue-ttl",
+        dest="queue_ttl",
+        help="Seconds (e.g., 2s) to share one job queue count across queue metrics (defaults to 0).",
+        default=defaults.QUEUE_TTL,
+        type=utils.parse_duration,
+    )
+    bench.add_argument(
+        "--json",
+        help="Print results as json.",
+        default=False,
+        action="store_true",
+    )
     return parser
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """
+    Run the background metric collector (and access log) for the life of the server.
+
+    A worker serves the values its parent collects instead. With --verbose,
+    we also measure how late the event loop runs.
+    """
+    access.start()
+    tasks = []
+    if workers.shared_values is not None:
+        follow = workers.follow(workers.shared_values, workers.shared_measurements)
+        tasks.append(asyncio.create_task(follow))
+    elif defaults.COLLECT_INTERVAL:
+        tasks.append(asyncio.create_task(collector.run(defaults.COLLECT_INTERVAL)))
+    if instrument.enabled:
+        tasks.append(asyncio.create_task(instrument.watch_loop()))
+    yield
+    for task in tasks:
+        task.cancel()
+    access.stop()
+
+
 def start(args):
     """
     Start the server with uvicorn
@@ -113,18 +378,96 @@ def start(args):
     if args.ssl_certfile and not args.ssl_keyfile:
         sys.exit("A --ssl-certfile was provided without a --ssl-keyfile.")
 
-    # The user wants to add a file with custom metrics
-    if args.custom_metric:
-        metrics.add_custom_metrics(args.custom_metric)
-    app = Starlette(debug=args.debug, routes=routes)
-    uvicorn.run(
+    # Metrics are collected in a bounded pool of threads
+    if args.threads < 1:
+        sys.exit("--threads must be at least 1.")
+    defaults.THREADS = args.threads
+    defaults.METRIC_TIMEOUT = args.metric_timeout
+    defaults.COLLECT_INTERVAL = args.collect_interval
+    defaults.MAX_STALENESS = args.max_staleness
+    defaults.STALE_AFTER = args.stale_after
+    if args.history_size < 1:
+        sys.exit("--history-size must be at least 1.")
+    defaults.HISTORY_SIZE = args.history_size
+    defaults.HISTORY_DIR = args.history_dir
+    defaults.RATE_INTERVAL = args.rate_interval
+
+    # Log requests from a background thread
+    defaults.ACCESS_LOG = args.access_log
+    defaults.ACCESS_LOG_SAMPLE = args.access_log_sample
+
+    # Measure the server itself (see /metrics/server)
+    if args.verbose:
+        instrument.enable()
+
+    # Worker processes serve values collected on an interval by their parent
+    if args.workers < 1:
+        sys.exit("--workers must be at least 1.")
+    defaults.WORKERS = args.workers
+    if defaults.WORKERS > 1 and not defaults.COLLECT_INTERVAL:
+        defaults.COLLECT_INTERVAL = defaults.WORKERS_COLLECT_INTERVAL
+        print(f"Collecting metrics every {defaults.COLLECT_INTERVAL}s for workers")
+
+    # Resources and jobs come from Flux, or synthetic data
+    options = {}
+    if args.backend == "synthetic":
+        options = get_synthetic_options(args)
+    try:
+        backends.set_backend(args.backend, **options)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    # Node and queue metrics share one cached resource listing and queue count
+    metrics.resource_listing.ttl = args.resource_ttl
+    metrics.queue_counts.ttl = args.queue_ttl
+    metrics.queue_labels.ttl = args.queue_ttl
+    metrics.job_listing.ttl = args.queue_ttl
+
+    # Keep history on disk, and fill windowed metrics with what we have (before
+    # forking, so workers start with it too)
+    if defaults.HISTORY_DIR:
+        if not defaults.COLLECT_INTERVAL:
+            sys.exit("--history-dir requires --collect-interval (or --workers).")
+        try:
+            store.open_directory(defaults.HISTORY_DIR)
+        except OSError as e:
+            sys.exit(f"Cannot use --history-dir {defaults.HISTORY_DIR}: {e}")
+        store.warm()
+
+    # The user wants to add files with custom metrics, and installed packages
+    # can provide them as entry points (imported on first use)
+    for metric_file in args.custom_metric:
+        plugins.add_custom_metrics(metric_file)
+    plugins.add_entry_points()
+    # Render static parts of responses now that defaults and metrics are final
+    responses.prepare()
+    prepare_documents()
+    app = Starlette(debug=args.debug, routes=routes, lifespan=lifespan)
+    config = uvicorn.Config(
         app,
         host=args.host,
         port=args.port,
         ssl_keyfile=args.ssl_keyfile,
         ssl_certfile=args.ssl_certfile,
+        access_log=False,
     )
 
+    # Fork workers before starting threads (e.g., to watch job events), which
+    # do not survive a fork. Workers forked later to replace one reset them.
+    pool = None
+    if defaults.WORKERS > 1:
+        pool = workers.WorkerPool(config, defaults.WORKERS)
+        pool.start()
+
+    # Keep queue counts updated from the job-manager journal
+    if args.queue_events:
+        source = backends.get_backend().event_source()
+        metrics.queue_events = events.watch_queue(source)
+
+    if pool is not None:
+        return pool.run(defaults.COLLECT_INTERVAL)
+    uvicorn.Server(config).run()
+
 
 def main():
     parser = get_parser()
@@ -155,6 +498,12 @@ def main():
         debug=args.debug,
     )
 
+    # Benchmark with synthetic data (and default paths and names)
+    if args.command == "bench":
+        from flux_metrics_api.bench import run
+
+        return run(args)
+
     # Setup the registry - non verbose is default
     if args.api_path is not None:
         defaults.API_ROOT = args.api_path
@@ -0,0 +1,81 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+import collections
+import threading
+import time
+
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.executor as executor
+import flux_metrics_api.types as types
+from flux_metrics_api.logger import logger
+
+# Keys (e.g., selectors or nodes) to remember the last good values for
+MAX_ENTRIES = 1024
+
+# The last good values for each key, as (values, timestamp, monotonic time)
+known_good = collections.OrderedDict()
+lock = threading.Lock()
+
+
+def remember(key, values):
+    """
+    Remember values collected for a key, with the time they were collected.
+    """
+    with lock:
+        known_good[key] = (values, types.get_timestamp(), time.monotonic())
+        known_good.move_to_end(key)
+        while len(known_good) > MAX_ENTRIES:
+            known_good.popitem(last=False)
+
+
+def recall(key):
+    """
+    Get the last good (values, timestamp) for a key, or None if too stale.
+    """
+    with lock:
+        entry = known_good.get(key)
+    if entry is None or time.monotonic() - entry[2] > defaults.MAX_STALENESS:
+        return None
+    return entry[0], entry[1]
+
+
+async def collect(key, func, *args):
+    """
+    Collect values with one shared call per key, as (values, timestamp).
+
+    The timestamp is None for values collected now. If --max-staleness is
+    set and the call takes longer than --stale-after (or fails), we return
+    the last good values (with the time they were collected) and the call
+    continues in the background to refresh them. Once they are older than
+    the max staleness, we wait for the call and report its errors.
+    """
+    if not defaults.MAX_STALENESS:
+        values = await executor.run_shared(
+            key, func, *args, timeout=defaults.METRIC_TIMEOUT
+        )
+        return values, None
+
+    def refresh():
+        values = func(*args)
+        remember(key, values)
+        return values
+
+    known = recall(key)
+    if known is None:
+        values = await executor.run_shared(
+            key, refresh, timeout=defaults.METRIC_TIMEOUT
+        )
+        return values, None
+
+    try:
+        values = await executor.run_shared(key, refresh, timeout=defaults.STALE_AFTER)
+        return values, None
+    except asyncio.TimeoutError:
+        return known
+    except Exception as e:
+        logger.warning(f"Serving last good values, cannot collect {key}: {e}")
+        return known
@@ -0,0 +1,195 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import bisect
+import mmap
+import numbers
+import os
+import re
+import struct
+import threading
+import time
+
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.history as history
+from flux_metrics_api.logger import logger
+
+# Each metric has a file that starts with this header, followed by
+# (timestamp, value) records of the same width
+HEADER = b"FMAHIST1"
+RECORD = struct.Struct("<dd")
+
+# Metric names that are safe to use as file names
+name_pattern = re.compile("^[A-Za-z0-9_.:-]+$")
+
+# The directory records are written to (see --history-dir), None if disabled
+directory = None
+
+# Open file descriptors to append to, and the last timestamp, by metric name
+appending = {}
+last_written = {}
+lock = threading.Lock()
+
+
+class Records:
+    """
+    The timestamps of records in a memory-mapped history file, as a sequence.
+
+    This lets us bisect the file for a time without reading all of it.
+    """
+
+    def __init__(self, mapped, count):
+        self.mapped = mapped
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.get(index)[0]
+
+    def get(self, index):
+        return RECORD.unpack_from(self.mapped, len(HEADER) + index * RECORD.size)
+
+
+def get_path(metric_name):
+    """
+    Get the history file for a metric, or None if it cannot have one.
+    """
+    if directory is None or not name_pattern.match(metric_name):
+        return None
+    return os.path.join(directory, metric_name + ".hist")
+
+
+def open_directory(path):
+    """
+    Write history to (and read history from) files in a directory.
+    """
+    global directory
+    os.makedirs(path, exist_ok=True)
+    directory = os.path.abspath(path)
+
+
+def get_metric_names():
+    """
+    Get the names of metrics that have history files.
+    """
+    if directory is None:
+        return []
+    return sorted(
+        x[: -len(".hist")] for x in os.listdir(directory) if x.endswith(".hist")
+    )
+
+
+def get_appender(metric_name):
+    """
+    Get a file descriptor to append records for a metric to.
+    """
+    fd = appending.get(metric_name)
+    if fd is not None:
+        return fd
+    path = get_path(metric_name)
+    if path is None:
+        return None
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    size = os.fstat(fd).st_size
+    if not size:
+        os.write(fd, HEADER)
+
+    # A partial record (e.g., from a crash) is dropped so records stay aligned
+    elif (size - len(HEADER)) % RECORD.size:
+        os.truncate(path, size - (size - len(HEADER)) % RECORD.size)
+    appending[metric_name] = fd
+    return fd
+
+
+def record(values, timestamp=None):
+    """
+    Append a record for each metric value (keyed by name) that is a number.
+
+    Each record is one write, so readers (in any process) see whole records.
+    Timestamps never go backwards within a file, so we can bisect it.
+    """
+    if directory is None:
+        return
+    timestamp = timestamp or time.time()
+    with lock:
+        for metric_name, value in values.items():
+            if not isinstance(value, numbers.Real):
+                continue
+            try:
+                fd = get_appender(metric_name)
+                if fd is None:
+                    continue
+                stamp = max(timestamp, last_written.get(metric_name, 0))
+                os.write(fd, RECORD.pack(stamp, value))
+                last_written[metric_name] = stamp
+            except OSError as e:
+                logger.warning(f"Cannot write history for {metric_name}: {e}")
+
+
+def read(metric_name, since=0, until=None, limit=None):
+    """
+    Read (timestamp, value) records for a metric from since to until.
+
+    The file is memory-mapped and bisected for since, so only the pages with
+    the records we return are read. Returns None if there is no history file.
+    """
+    path = get_path(metric_name)
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        count = max(0, (size - len(HEADER)) // RECORD.size)
+        if not count:
+            return []
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped[: len(HEADER)] != HEADER:
+                logger.warning(f"{path} is not a history file, ignoring it.")
+                return None
+            records = Records(mapped, count)
+            start = bisect.bisect_left(records, since)
+            end = count if until is None else bisect.bisect_right(records, until)
+            if limit is not None:
+                end = min(end, start + limit)
+            return [records.get(i) for i in range(start, end)]
+
+
+def warm():
+    """
+    Fill the windowed metric buffers with the newest records of each metric.
+    """
+    for metric_name in get_metric_names():
+        path = get_path(metric_name)
+        if path is None:
+            continue
+        samples = read_newest(metric_name, defaults.HISTORY_SIZE)
+        if not samples:
+            continue
+        buffer = history.buffers.get(metric_name)
+        if buffer is None:
+            buffer = history.buffers[metric_name] = history.RingBuffer(
+                defaults.HISTORY_SIZE
+            )
+        for timestamp, value in samples:
+            buffer.append(timestamp, value)
+        last_written[metric_name] = samples[-1][0]
+
+
+def read_newest(metric_name, count):
+    """
+    Read the newest count records for a metric, oldest first.
+    """
+    path = get_path(metric_name)
+    size = os.path.getsize(path)
+    total = max(0, (size - len(HEADER)) // RECORD.size)
+    start = max(0, total - count)
+    with open(path, "rb") as fd:
+        if fd.read(len(HEADER)) != HEADER:
+            logger.warning(f"{path} is not a history file, ignoring it.")
+            return []
+        fd.seek(len(HEADER) + start * RECORD.size)
+        data = fd.read((total - start) * RECORD.size)
+    return list(RECORD.iter_unpack(data[: len(data) - len(data) % RECORD.size]))
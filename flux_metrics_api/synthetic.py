@@ -0,0 +1,283 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import collections
+import json
+import random
+import threading
+import time
+
+# Lookup of state integer to name, as in metrics.job_states
+job_states = {
+    1: "new",
+    2: "depend",
+    4: "priority",
+    8: "sched",
+    16: "run",
+    32: "cleanup",
+    64: "inactive",
+}
+
+# Relative number of active jobs in each active state
+active_weights = {
+    1: 1,
+    2: 1,
+    4: 2,
+    8: 20,
+    16: 70,
+    32: 6,
+}
+
+
+def compress_ids(ids):
+    """
+    Compress sorted integers into an idset string (e.g., 0-3,5).
+    """
+    ranges = []
+    for i in ids:
+        if ranges and ranges[-1][1] == i - 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ",".join(str(x) if x == y else f"{x}-{y}" for x, y in ranges)
+
+
+class SyntheticResourceSet:
+    """
+    A set of resources with the attributes metrics use from a Flux ResourceSet.
+
+    ranks maps each rank to (cores, gpus), and properties maps each property
+    to the ranks that have it.
+    """
+
+    def __init__(self, ranks, properties=None):
+        self.ranks = {r: x for r, x in sorted(ranks.items()) if x[0] or x[1]}
+        self.properties = properties or {}
+        self.ncores = sum(x[0] for x in self.ranks.values())
+        self.ngpus = sum(x[1] for x in self.ranks.values())
+        self.nodelist = [f"node{r}" for r in self.ranks]
+        self.nnodes = len(self.ranks)
+
+    def encode(self):
+        """
+        Encode the set as R, with ranks that have the same children together.
+        """
+        children = collections.defaultdict(list)
+        for rank, (cores, gpus) in self.ranks.items():
+            children[(cores, gpus)].append(rank)
+        R_lite = []
+        for (cores, gpus), ranks in children.items():
+            entry = {"rank": compress_ids(ranks), "children": {}}
+            if cores:
+                entry["children"]["core"] = f"0-{cores - 1}"
+            if gpus:
+                entry["children"]["gpu"] = f"0-{gpus - 1}"
+            R_lite.append(entry)
+
+        properties = {}
+        for prop, ranks in self.properties.items():
+            ranks = [x for x in ranks if x in self.ranks]
+            if ranks:
+                properties[prop] = compress_ids(ranks)
+        execution = {"R_lite": R_lite, "nodelist": self.nodelist}
+        if properties:
+            execution["properties"] = properties
+        return json.dumps({"version": 1, "execution": execution})
+
+
+class SyntheticResourceList:
+    """
+    A resource listing, with the up, free, and allocated resource sets.
+    """
+
+    def __init__(self, up, free, allocated):
+        self.up = up
+        self.free = free
+        self.allocated = allocated
+
+
+class SyntheticFlux:
+    """
+    Generated Flux data (nodes and jobs) that answers the calls metrics makes.
+
+    Jobs are generated once from a seed, so runs are reproducible. Each job
+    is one core, and running jobs are packed onto nodes in their queue, where
+    nodes are split evenly across queues (with the queue as a property).
+    Calls are counted by name, like RPCs to a broker, and each waits for
+    latency seconds.
+    """
+
+    def __init__(
+        self,
+        nodes=16,
+        cores=8,
+        gpus=0,
+        jobs=1000,
+        active=0.1,
+        queues=("batch", "debug"),
+        users=4,
+        seed=0,
+        latency=0,
+    ):
+        if not 0 < users <= 256 or not 0 < len(queues) <= 256:
+            raise ValueError("There must be between 1 and 256 users and queues.")
+        rng = random.Random(seed)
+        self.queues = list(queues)
+        self.users = [1000 + i for i in range(users)]
+        self.jobs = jobs
+        self.latency = latency
+        self.stateints = list(job_states)
+        self.lock = threading.Lock()
+        self.rpcs = collections.Counter()
+
+        # One byte per job for its state, queue, and user, so a million is cheap
+        states = self.stateints
+        active_states = list(active_weights)
+        weights = list(active_weights.values())
+        self.states = bytearray(jobs)
+        self.job_queues = bytearray(jobs)
+        self.job_users = bytearray(jobs)
+        inactive = states.index(64)
+        for i in range(jobs):
+            if rng.random() < active:
+                state = rng.choices(active_states, weights)[0]
+                self.states[i] = states.index(state)
+            else:
+                self.states[i] = inactive
+            self.job_queues[i] = i % len(self.queues)
+            self.job_users[i] = rng.randrange(users)
+        self.submitted = time.time() - jobs
+
+        # Nodes are split across queues, and running jobs take a core from one
+        ranks = {r: (cores, gpus) for r in range(nodes)}
+        properties = collections.defaultdict(list)
+        for rank in range(nodes):
+            properties[self.queues[rank % len(self.queues)]].append(rank)
+        used = collections.Counter()
+        for i in range(jobs):
+            if job_states[states[self.states[i]]] != "run":
+                continue
+            for rank in properties[self.queues[self.job_queues[i]]]:
+                if used[rank] < cores:
+                    used[rank] += 1
+                    break
+        free = {r: (cores - used[r], gpus) for r in ranks}
+        allocated = {r: (used[r], 0) for r in ranks}
+        self.listing = SyntheticResourceList(
+            SyntheticResourceSet(ranks, properties),
+            SyntheticResourceSet(free, properties),
+            SyntheticResourceSet(allocated, properties),
+        )
+        self.stats = self.count_stats()
+
+    def call(self, name):
+        """
+        Count a call by name, and wait for the latency of a broker.
+        """
+        with self.lock:
+            self.rpcs[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def count_stats(self):
+        """
+        Count jobs in each state, overall and by queue, as the stats RPC does.
+        """
+        states = list(job_states.values())
+        totals = collections.Counter()
+        queues = collections.defaultdict(collections.Counter)
+        for i in range(self.jobs):
+            state = states[self.states[i]]
+            totals[state] += 1
+            queues[self.queues[self.job_queues[i]]][state] += 1
+
+        def stats(counter):
+            counts = {name: counter[name] for name in states}
+            counts["total"] = sum(counter.values())
+            return counts
+
+        return {
+            "job_states": stats(totals),
+            "queues": [
+                {"name": name, "job_states": stats(queues[name])}
+                for name in self.queues
+            ],
+        }
+
+    def get_job(self, i, attrs):
+        """
+        Get a job (a dict of attributes) as listed by job-list.
+        """
+        job = {"id": i + 1}
+        for attr in attrs:
+            if attr == "state":
+                job["state"] = self.stateints[self.states[i]]
+            elif attr == "queue":
+                job["queue"] = self.queues[self.job_queues[i]]
+            elif attr == "userid":
+                job["userid"] = self.users[self.job_users[i]]
+            elif attr in ["nnodes", "ntasks", "ncores"]:
+                job[attr] = 1
+            elif attr == "t_submit":
+                job["t_submit"] = self.submitted + i
+        return job
+
+    def list_resources(self):
+        """
+        Get the resource listing, as flux.resource.list.resource_list does.
+        """
+        self.call("resource_list")
+        return self.listing
+
+    def get_job_stats(self):
+        """
+        Get job counts, as the job-list.job-stats RPC does.
+        """
+        self.call("job_stats")
+        return self.stats
+
+    def list_jobs(self, attrs, states=0):
+        """
+        List jobs in states (a mask, where 0 is all), as flux.job.job_list does.
+        """
+        self.call("job_list")
+        wanted = bytes(
+            i for i, state in enumerate(self.stateints) if not states or state & states
+        )
+        return [
+            self.get_job(i, attrs)
+            for i, state in enumerate(self.states)
+            if state in wanted
+        ]
+
+    def event_source(self):
+        """
+        Get a source of job events that replays the events of every job.
+        """
+        return SyntheticEventSource(self)
+
+
+# Events that take a job from nothing to each state, in order
+job_events = ["submit", "validate", "depend", "priority", "alloc", "finish", "clean"]
+
+
+class SyntheticEventSource:
+    """
+    Replay events for each synthetic job, and then wait until closed.
+    """
+
+    def __init__(self, synthetic):
+        self.synthetic = synthetic
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+    def events(self):
+        for i, state in enumerate(self.synthetic.states):
+            for name in job_events[: state + 1]:
+                yield i + 1, name, None
+        yield None, None, None
+        self.closed.wait()
@@ -0,0 +1,177 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import flux_metrics_api.defaults as defaults
+from flux_metrics_api.apis import KubernetesClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the API server, recording connections and tokens.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers["Authorization"]))
+        if self.path.startswith("/fail"):
+            status, body = 500, b"{}"
+        else:
+            status, body = 200, json.dumps({"path": self.path}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def service_account(tmp_path):
+    """
+    A service account directory with a self-signed certificate for localhost.
+    """
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to create a certificate")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+            "-keyout",
+            str(tmp_path / "tls.key"),
+            "-out",
+            str(tmp_path / "ca.crt"),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    (tmp_path / "token").write_text("first-token\n")
+    (tmp_path / "namespace").write_text("flux-operator")
+    return tmp_path
+
+
+@pytest.fixture
+def api_server(service_account):
+    """
+    Serve the stand-in API server over HTTPS on a free port.
+    """
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(service_account / "ca.crt", service_account / "tls.key")
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_client(api_server, service_account, **kwargs):
+    return KubernetesClient(
+        api_server=f"https://localhost:{api_server.server_address[1]}",
+        sa_account_dir=str(service_account),
+        **kwargs,
+    )
+
+
+def test_connection_is_reused(api_server, service_account):
+    client = get_client(api_server, service_account, cache_ttl=0)
+    for _ in range(5):
+        assert client.get("/apis") == {"path": "/apis"}
+    assert len(api_server.requests) == 5
+    assert api_server.connections == 1
+
+
+def test_token_is_read_again_when_changed(api_server, service_account):
+    client = get_client(api_server, service_account, cache_ttl=0)
+    client.get("/apis")
+    client.get("/apis")
+
+    # The kubelet rotates the token by replacing the file
+    token_file = service_account / "token"
+    token_file.write_text("second-token\n")
+    mtime = os.stat(token_file).st_mtime + 10
+    os.utime(token_file, (mtime, mtime))
+    client.get("/apis")
+
+    tokens = [x[1] for x in api_server.requests]
+    assert tokens == ["Bearer first-token"] * 2 + ["Bearer second-token"]
+
+
+def test_cache_expires(api_server, service_account):
+    client = get_client(api_server, service_account, cache_ttl=0.2)
+    client.get("/apis")
+    client.get("/apis")
+    assert len(api_server.requests) == 1
+
+    time.sleep(0.3)
+    client.get("/apis")
+    assert len(api_server.requests) == 2
+
+
+def test_cache_evicts_oldest(api_server, service_account, monkeypatch):
+    monkeypatch.setattr(defaults, "USE_CACHE", True)
+    client = get_client(api_server, service_account, cache_ttl=300, cache_size=2)
+    for endpoint in ["/a", "/b", "/c"]:
+        client.get(endpoint)
+    assert list(client.cache) == ["/b", "/c"]
+
+    # The evicted endpoint is requested again, and the others are not
+    client.get("/c")
+    client.get("/a")
+    assert [x[0] for x in api_server.requests] == ["/a", "/b", "/c", "/a"]
+
+
+def test_error_response_is_empty(api_server, service_account):
+    client = get_client(api_server, service_account, cache_ttl=0)
+    assert client.get("/fail") == {}
+    assert client.get("/apis") == {"path": "/apis"}
+
+
+def test_not_in_cluster(tmp_path):
+    client = KubernetesClient(sa_account_dir=str(tmp_path / "missing"))
+    assert client.get("/apis") == {}
+
+
+def test_closed_connection_is_retried(api_server, service_account):
+    client = get_client(api_server, service_account, cache_ttl=0)
+    client.get("/apis")
+
+    # The idle connection in the pool was closed (e.g., by the server)
+    stale = client.pool.queue[0]
+    stale.sock.close()
+    assert client.get("/apis") == {"path": "/apis"}
+    assert api_server.connections == 2
+    assert stale not in client.pool.queue
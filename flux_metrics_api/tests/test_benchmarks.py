@@ -0,0 +1,68 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+# Benchmarks of routes against synthetic Flux data, for regressions in how
+# they scale with jobs. Run with: pytest flux_metrics_api/tests/test_benchmarks.py
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+import flux_metrics_api.backends as backends  # noqa: E402
+import flux_metrics_api.collector as collector  # noqa: E402
+import flux_metrics_api.metrics as metrics  # noqa: E402
+from flux_metrics_api.bench import get_routes  # noqa: E402
+from flux_metrics_api.routes import routes  # noqa: E402
+
+# Cached Flux data, which is refreshed for every request (a ttl of 0)
+caches = [
+    metrics.resource_listing,
+    metrics.queue_counts,
+    metrics.queue_labels,
+    metrics.job_listing,
+]
+
+
+@pytest.fixture(params=[1000, 10000, 100000], ids=lambda x: f"jobs={x}")
+def synthetic(request, monkeypatch):
+    """
+    Use synthetic Flux data with a number of jobs, and nothing cached.
+    """
+    monkeypatch.setattr(backends, "backend", None)
+    backends.set_backend("synthetic", jobs=request.param)
+    monkeypatch.setattr(collector, "values", {})
+    monkeypatch.setattr(collector, "rendered", {})
+    for cache in caches:
+        monkeypatch.setattr(cache, "ttl", 0)
+        cache.clear()
+    yield backends.get_backend()
+    for cache in caches:
+        cache.clear()
+
+
+@pytest.fixture
+def client(synthetic):
+    with TestClient(Starlette(routes=routes)) as client:
+        yield client
+
+
+@pytest.mark.parametrize("route", ["queue", "batch", "selector"])
+def test_route(benchmark, client, route):
+    path = get_routes("default", "batch")[route]
+    response = benchmark(client.get, path)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("use_job_stats", [True, False], ids=["stats", "listing"])
+def test_get_queue_metrics(benchmark, synthetic, monkeypatch, use_job_stats):
+    """
+    Queue counts come from the stats RPC, or (without it) a listing of jobs.
+    """
+    monkeypatch.setattr(metrics, "use_job_stats", use_job_stats)
+    counts = benchmark(metrics.get_queue_metrics)
+    assert sum(counts.values()) == synthetic.jobs
@@ -0,0 +1,112 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import threading
+
+from flux_metrics_api.events import FakeEventSource, QueueCounters, watch_queue
+
+# Events that take a job from submit to run
+running = ["submit", "validate", "depend", "priority", "alloc"]
+
+
+def replay(events):
+    """
+    Watch a closed fake event source, so watch returns when it is exhausted.
+    """
+    source = FakeEventSource(events)
+    source.close()
+    counters = QueueCounters()
+    counters.watch(source)
+    return counters
+
+
+def test_counts_follow_transitions():
+    counters = replay(
+        [(1, name) for name in running]
+        + [(2, name) for name in running[:4]]
+        + [(3, "submit")]
+    )
+    counts = counters.get()
+    assert counts["run"] == 1
+    assert counts["sched"] == 1
+    assert counts["new"] == 1
+    assert sum(counts.values()) == 3
+
+    counters.update(1, "finish")
+    counters.update(1, "clean")
+    counts = counters.get()
+    assert counts["run"] == 0
+    assert counts["inactive"] == 1
+
+    # Inactive jobs are forgotten, so memory scales with active jobs
+    assert 1 not in counters.states
+
+
+def test_fatal_exception_moves_to_cleanup():
+    counters = replay([(1, name) for name in running[:4]])
+    counters.update(1, "exception", {"severity": 0, "type": "cancel"})
+    counts = counters.get()
+    assert counts["sched"] == 0
+    assert counts["cleanup"] == 1
+
+
+def test_nonfatal_exception_is_ignored():
+    counters = replay([(1, name) for name in running[:4]])
+    counters.update(1, "exception", {"severity": 1, "type": "test"})
+    assert counters.get()["sched"] == 1
+    assert counters.get()["cleanup"] == 0
+
+
+def test_events_from_wrong_state_are_ignored():
+    counters = replay([(1, "submit")])
+
+    # A job that is new cannot be allocated, finished, or cleaned
+    for name in ["alloc", "finish", "clean", "priority"]:
+        counters.update(1, name)
+    assert counters.get()["new"] == 1
+    assert counters.states[1] == "new"
+
+    # An exception before the job is validated does not move it either
+    counters.update(1, "exception", {"severity": 0})
+    assert counters.get()["cleanup"] == 0
+
+    # Unknown events and jobs we never saw submitted are ignored
+    counters.update(1, "annotations")
+    counters.update(2, "alloc")
+    assert sum(counters.get().values()) == 1
+
+
+def test_totals_are_cumulative():
+    counters = replay(
+        [(jobid, name) for jobid in range(3) for name in running]
+        + [(0, "finish"), (0, "clean")]
+    )
+    totals = counters.get_totals()
+    assert totals["new"] == 3
+    assert totals["run"] == 3
+    assert totals["cleanup"] == 1
+    assert totals["inactive"] == 1
+
+    # Totals are not decremented when jobs leave a state
+    assert counters.get()["run"] == 2
+
+
+def test_ready_after_replay_sentinel():
+    source = FakeEventSource([(1, "submit")])
+    counters = watch_queue(source)
+    assert not counters.ready.wait(0.1)
+
+    # A jobid of None marks the end of the history
+    source.emit(None, None)
+    assert counters.ready.wait(5)
+    source.emit(1, "validate")
+    source.close()
+
+    # Readers go back to listing jobs when the stream ends
+    for thread in threading.enumerate():
+        if thread.name == "flux-metrics-events":
+            thread.join(5)
+    assert not counters.ready.is_set()
+    assert counters.get()["depend"] == 1
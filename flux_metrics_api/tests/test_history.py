@@ -0,0 +1,19 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+from flux_metrics_api.history import RingBuffer
+
+
+def test_summarize_reports_seconds_covered():
+    buffer = RingBuffer(4)
+    for i in range(6):
+        buffer.append(100 + i * 5, i)
+
+    # Only the last four samples (from 110 to 125) are kept
+    assert buffer.summarize(3600, "max", now=126) == (5, 16)
+    assert buffer.summarize(3600, "min", now=126) == (2, 16)
+    assert buffer.summarize(6, "avg", now=126) == (4.5, 6)
+    assert buffer.summarize(3600, "rate", now=126) == (0.2, 16)
+    assert buffer.summarize(0.5, now=126) is None
@@ -0,0 +1,41 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import collections
+
+import flux_metrics_api.instrument as instrument
+from flux_metrics_api.cache import CachedCall
+
+
+def reset(monkeypatch):
+    """
+    Start with no measurements, as a new process would.
+    """
+    for name in ["collect_seconds", "call_seconds"]:
+        monkeypatch.setattr(
+            instrument, name, collections.defaultdict(instrument.Histogram)
+        )
+
+
+def test_shared_measurements_are_added(monkeypatch):
+    reset(monkeypatch)
+
+    # Measurements from the parent, as they are shared with a worker
+    instrument.collect_seconds["node_up_count"].observe(0.001)
+    instrument.call_seconds["resource_list"].observe(0.002)
+    cache = CachedCall(lambda: 1)
+    cache.get()
+    cache.get()
+    shared = instrument.get_measurements({"resources": cache})
+
+    # The worker collected one metric itself
+    reset(monkeypatch)
+    instrument.collect_seconds["node_up_count"].observe(0.5)
+    monkeypatch.setattr(instrument, "shared", shared)
+    text = instrument.render({"resources": CachedCall(lambda: 1)}).decode("utf-8")
+
+    assert 'flux_metrics_api_collect_seconds_count{metric="node_up_count"} 2' in text
+    assert 'flux_metrics_api_flux_call_seconds_count{call="resource_list"} 1' in text
+    assert 'cache_requests_total{cache="resources",result="miss"} 2' in text
@@ -0,0 +1,74 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import flux_metrics_api.backends as backends
+from flux_metrics_api.plugins import Plugin, PluginTimeout, metric
+
+
+@pytest.fixture(autouse=True)
+def synthetic(monkeypatch):
+    monkeypatch.setattr(backends, "backend", None)
+    backends.set_backend("synthetic", jobs=10)
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    @metric(timeout=5)
+    def slow_metric(handle):
+        calls.append(1)
+        time.sleep(0.3)
+        return len(calls)
+
+    plugin = Plugin("slow_metric", func=slow_metric)
+    with ThreadPoolExecutor(3) as pool:
+        values = list(pool.map(lambda _: plugin.collect(), range(3)))
+    assert values == [1, 1, 1]
+    assert len(calls) == 1
+
+
+def test_call_past_timeout_fails_fast():
+    release = threading.Event()
+
+    @metric(timeout=0.2)
+    def hanging_metric(handle):
+        release.wait(5)
+        return 1
+
+    plugin = Plugin("hanging_metric", func=hanging_metric)
+    with pytest.raises(PluginTimeout, match="did not return"):
+        plugin.collect()
+
+    start = time.monotonic()
+    with pytest.raises(PluginTimeout, match="still running"):
+        plugin.collect()
+    assert time.monotonic() - start < 0.1
+
+    # Once the call returns, the next one runs
+    release.set()
+    plugin.running.result(5)
+    assert plugin.collect() == 1
+
+
+def test_deadline_before_timeout():
+    @metric(timeout=5)
+    def slow_metric(handle):
+        time.sleep(0.5)
+        return 1
+
+    plugin = Plugin("slow_metric", func=slow_metric)
+    start = time.monotonic()
+    with pytest.raises(PluginTimeout):
+        plugin.collect(deadline=time.monotonic() + 0.1)
+    assert time.monotonic() - start < 0.4
+
+    # A caller without a deadline still shares the call in progress
+    assert plugin.collect() == 1
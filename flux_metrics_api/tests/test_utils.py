@@ -0,0 +1,22 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import pytest
+
+from flux_metrics_api.utils import parse_duration
+
+
+@pytest.mark.parametrize(
+    "duration,seconds",
+    [("500ms", 0.5), ("2s", 2), ("1m", 60), ("1h", 3600), ("10", 10), (5, 5)],
+)
+def test_parse_duration(duration, seconds):
+    assert parse_duration(duration) == seconds
+
+
+@pytest.mark.parametrize("duration", ["nan", "inf", "-infs", "-1s", "soon", "1d"])
+def test_parse_duration_invalid(duration):
+    with pytest.raises(ValueError):
+        parse_duration(duration)
@@ -3,11 +3,11 @@
 #
 # SPDX-License-Identifier: (MIT)
 
-from datetime import datetime
+import time
 
 import flux_metrics_api.apis as apis
 import flux_metrics_api.defaults as defaults
-from flux_metrics_api.metrics import metrics
+from flux_metrics_api.metrics import custom_metrics, metrics
 
 
 def new_group_list():
@@ -35,7 +35,7 @@ def new_resource_list():
         "resources": [],
     }
 
-    for metric_name in metrics:
+    for metric_name in list(metrics) + list(custom_metrics):
         listing["resources"].append(
             {
                 "name": metric_name,
@@ -48,6 +48,23 @@ def new_resource_list():
     return listing
 
 
+# The last timestamp, which only needs to be formatted once a second
+last_timestamp = {"seconds": None, "timestamp": ""}
+
+
+def get_timestamp():
+    """
+    Get the current (UTC) time formatted for a metric value.
+    """
+    seconds = int(time.time())
+    if seconds != last_timestamp["seconds"]:
+        last_timestamp["timestamp"] = time.strftime(
+            "%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(seconds)
+        )
+        last_timestamp["seconds"] = seconds
+    return last_timestamp["timestamp"]
+
+
 def new_identifier(name: str, selector: dict = None):
     """
     Get a new metric identifier.
@@ -60,6 +77,19 @@ def new_identifier(name: str, selector: dict = None):
     return metric
 
 
+def new_described_object(kind="Service", name=None):
+    """
+    Our custom metrics API comes from a service, unless we describe an object
+    (e.g., a Node) in the Flux instance.
+    """
+    return {
+        "kind": kind,
+        "namespace": defaults.NAMESPACE,
+        "name": name or defaults.SERVICE_NAME,
+        "apiVersion": defaults.API_VERSION(),
+    }
+
+
 def new_metric(metric, value, timestamp="", windowSeconds=0):
     """
     Get the metric value for an object.
@@ -69,22 +99,12 @@ def new_metric(metric, value, timestamp="", windowSeconds=0):
     which the metric was calculated (0 for instantaneous, which is what we are making).
     describedObject is the object the metric was collected from.
     """
-    # This probably needs work - I just fudged it for now
-    timestamp = timestamp or datetime.now().strftime("%Y-%m-%dT%H:%M:%S+00:00")
-
-    # Our custom metrics API always comes from a service
-    describedObject = {
-        "kind": "Service",
-        "namespace": defaults.NAMESPACE,
-        "name": defaults.SERVICE_NAME,
-        "apiVersion": defaults.API_VERSION(),
-    }
     return {
         "metric": metric,
         "value": value,
-        "timestamp": timestamp,
+        "timestamp": timestamp or get_timestamp(),
         "windowSeconds": windowSeconds,
-        "describedObject": describedObject,
+        "describedObject": new_described_object(),
     }
 
 
@@ -3,6 +3,7 @@
 #
 # SPDX-License-Identifier: (MIT)
 
+import math
 import os
 import tempfile
 from contextlib import contextmanager
@@ -46,3 +47,28 @@ def get_tmpdir(tmpdir=None, prefix="", create=True):
         os.mkdir(tmpdir)
 
     return tmpdir
+
+
+def parse_duration(duration):
+    """
+    Parse a duration (e.g., 500ms, 2s, 1m, or a plain number of seconds) into seconds.
+    """
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    duration = str(duration).strip()
+    for suffix in sorted(units, key=len, reverse=True):
+        if duration.endswith(suffix):
+            number = duration[: -len(suffix)]
+            multiplier = units[suffix]
+            break
+    else:
+        number = duration
+        multiplier = 1
+    try:
+        seconds = float(number) * multiplier
+    except ValueError:
+        raise ValueError(f"{duration} is not a valid duration (e.g., 500ms, 2s, 1m)")
+    if not math.isfinite(seconds):
+        raise ValueError(f"{duration} is not a valid duration (e.g., 500ms, 2s, 1m)")
+    if seconds < 0:
+        raise ValueError(f"{duration} cannot be negative")
+    return seconds
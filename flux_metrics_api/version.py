@@ -3,7 +3,7 @@
 #
 # SPDX-License-Identifier: (MIT)
 
-__version__ = "0.0.11"
+__version__ = "0.0.12"
 AUTHOR = "Vanessa Sochat"
 EMAIL = "vsoch@users.noreply.github.com"
 NAME = "flux-metrics-api"
@@ -21,9 +21,13 @@ INSTALL_REQUIRES = (
     ("starlette-apispec", {"min_version": None}),
 )
 
-TESTS_REQUIRES = (("pytest", {"min_version": "4.6.2"}),)
+TESTS_REQUIRES = (
+    ("pytest", {"min_version": "4.6.2"}),
+    ("pytest-benchmark", {"min_version": None}),
+)
 
 ################################################################################
 # Submodule Requirements (versions that include database)
 
-INSTALL_REQUIRES_ALL = INSTALL_REQUIRES
+# orjson is used (if installed) for faster responses
+INSTALL_REQUIRES_ALL = INSTALL_REQUIRES + (("orjson", {"min_version": None}),)
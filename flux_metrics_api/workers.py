@@ -0,0 +1,233 @@
+# Copyright 2023 Lawrence Livermore National Security, LLC and other
+# HPCIC DevTools Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (MIT)
+
+import asyncio
+import json
+import mmap
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+
+import uvicorn
+
+import flux_metrics_api.backends as backends
+import flux_metrics_api.collector as collector
+import flux_metrics_api.defaults as defaults
+import flux_metrics_api.instrument as instrument
+import flux_metrics_api.metrics as metrics
+import flux_metrics_api.responses as responses
+import flux_metrics_api.store as store
+from flux_metrics_api.logger import logger
+
+# Seconds between worker checks for newly published values
+FOLLOW_INTERVAL = 0.1
+
+# Values (and measurements, with --verbose) shared with this worker process,
+# if we are one
+shared_values = None
+shared_measurements = None
+
+
+class SharedValues:
+    """
+    Metric values published by one process and read by many, in shared memory.
+
+    The memory is anonymous and created before forking, so it is shared with
+    every worker. A header holds a sequence number and the length of the JSON
+    values that follow. The sequence is odd while a write is in progress, so a
+    reader that sees it change (or odd) knows to read again (a seqlock), and
+    readers never block the writer.
+    """
+
+    header = struct.Struct("QQ")
+
+    def __init__(self, size=None):
+        self.size = size or defaults.SHARED_VALUES_SIZE
+        self.buffer = mmap.mmap(-1, self.size)
+        self.sequence = 0
+
+    def publish(self, values):
+        """
+        Publish metric values (keyed by name) for workers to read.
+        """
+        data = responses.dumps(values)
+        if len(data) > self.size - self.header.size:
+            raise ValueError(
+                f"Metric values ({len(data)} bytes) do not fit in shared memory ({self.size} bytes)"
+            )
+        self.header.pack_into(self.buffer, 0, self.sequence + 1, 0)
+        self.buffer[self.header.size : self.header.size + len(data)] = data
+        self.sequence += 2
+        self.header.pack_into(self.buffer, 0, self.sequence, len(data))
+
+    def generation(self):
+        """
+        Get the sequence number of the published values (0 if there are none).
+        """
+        return self.header.unpack_from(self.buffer, 0)[0]
+
+    def read(self, retries=100):
+        """
+        Read the published values, as (sequence, values), or None if busy.
+        """
+        for _ in range(retries):
+            sequence, length = self.header.unpack_from(self.buffer, 0)
+            if sequence % 2 == 0:
+                data = self.buffer[self.header.size : self.header.size + length]
+                if self.generation() == sequence:
+                    return sequence, json.loads(data) if length else {}
+            time.sleep(0)
+        return None
+
+
+async def follow(shared, measurements=None, interval=FOLLOW_INTERVAL):
+    """
+    Serve values as they are published to a worker, until cancelled.
+
+    Checking for new values reads one integer, so this is cheap to poll.
+    Measurements of collecting them (if shared) are reported by the worker.
+    """
+    last = 0
+    last_measured = 0
+    while True:
+        if measurements is not None and measurements.generation() != last_measured:
+            result = measurements.read()
+            if result is not None:
+                last_measured, instrument.shared = result
+        if shared.generation() != last:
+            try:
+                result = shared.read()
+                if result is not None:
+                    last, values = result
+                    collector.publish(values)
+            except Exception as e:
+                logger.error(f"Cannot read shared metric values: {e}")
+        await asyncio.sleep(interval)
+
+
+class WorkerPool:
+    """
+    Serve the app from forked worker processes that share one collector.
+
+    The parent binds the socket, forks the workers, and then collects every
+    metric on the collect interval and publishes the values to shared memory.
+    Workers serve requests from those values, so adding workers adds HTTP
+    throughput and not broker RPCs. Each worker opens its own Flux handle
+    (on first use, after the fork) for metrics it must collect on demand,
+    such as for an object or a label selector. Workers that exit are replaced.
+    """
+
+    def __init__(self, config, count):
+        self.config = config
+        self.count = count
+        self.shared = SharedValues()
+
+        # The parent collects, so it shares its measurements with the workers
+        self.measurements = SharedValues() if instrument.enabled else None
+        self.socket = None
+        self.pids = set()
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Bind the socket and fork the workers.
+        """
+        self.socket = self.config.bind_socket()
+
+        # asyncio only disables Nagle's algorithm for connections on sockets it
+        # creates, and connections inherit it from the listening socket
+        if self.socket.family in (socket.AF_INET, socket.AF_INET6):
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for _ in range(self.count):
+            self.spawn()
+
+    def spawn(self):
+        """
+        Fork one worker, which serves until it is stopped and never returns.
+        """
+        pid = os.fork()
+        if pid:
+            self.pids.add(pid)
+            return pid
+
+        code = 0
+        try:
+            self.serve()
+        except BaseException as e:
+            logger.error(f"Worker {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def serve(self):
+        """
+        Run the server in a worker, with state from the parent reset.
+        """
+        global shared_values, shared_measurements
+        shared_values = self.shared
+        shared_measurements = self.measurements
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        # Handles, event watchers, and plugin threads belong to the parent, which
+        # may have started them before forking this worker (e.g., to replace one)
+        backends.get_backend().reset()
+        metrics.queue_events = None
+        for plugin in metrics.custom_metrics.values():
+            plugin.reset()
+        uvicorn.Server(self.config).run(sockets=[self.socket])
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def reap(self):
+        """
+        Replace workers that have exited.
+        """
+        for pid in list(self.pids):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if not done:
+                continue
+            self.pids.discard(pid)
+            if not self.stopped.is_set():
+                logger.warning(f"Worker {pid} exited ({status}), starting another.")
+                self.spawn()
+
+    def collect(self):
+        """
+        Collect every metric once and publish the values to the workers.
+        """
+        try:
+            values = collector.collect_values()
+            store.record(values)
+            self.shared.publish(values)
+            if self.measurements is not None:
+                self.measurements.publish(instrument.get_measurements(metrics.caches))
+        except Exception as e:
+            logger.error(f"Metric collection cycle failed: {e}")
+
+    def run(self, interval):
+        """
+        Collect and publish metrics every interval seconds, until signalled.
+        """
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        print(f"Serving from {self.count} workers: {', '.join(map(str, self.pids))}")
+        while not self.stopped.is_set():
+            self.collect()
+            self.reap()
+            self.stopped.wait(interval)
+
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.pids:
+            os.waitpid(pid, 0)
+        self.socket.close()